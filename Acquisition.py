@@ -0,0 +1,160 @@
+# Timing of TNMR acquisitions and waiting for them to finish
+
+# Imports
+import time
+
+from T1 import ToN
+
+# Global variables
+POLL_FAST = 0.02    # First poll interval once close to the expected end
+POLL_SLOW = 2       # Longest interval between two CheckAcquisition calls
+MARGIN = 0.95       # Fraction of the expected time spent sleeping
+
+# TNMR parameters whose delays add up to the length of one scan
+SCAN_DELAYS = ('Last Delay', 'pre', 'd1', 'd2', 'd3', 'd5', 'tau', 'ad', 'rd')
+
+
+
+def To_seconds(value):
+    '''Converts string value to a number, numbers stay as they are'''
+    return ToN(value) if type(value) == str else value
+
+
+
+def Get_time(settings, key):
+    '''Reads a TNMR parameter as a number, missing values count as 0'''
+    try:
+        return To_seconds(settings[key])
+    except (KeyError, ValueError):
+        return 0
+
+
+
+def Estimate_time(settings, tables=None):
+    '''Estimates the duration of an acquisition in seconds
+        settings: TNMR parameter names and their string values
+        tables: TNMR parameters swept in 2D, as lists of values
+            or SetTable strings'''
+    if tables is None:
+        tables = dict()
+    # Swept values replace the fixed parameter in every row
+    tables = {key.split(':')[0]: (value.split(' ') if type(value) == str
+        else value) for key, value in tables.items()}
+
+    # Duration of a single scan without the swept delays
+    scan = sum(Get_time(settings, key) for key in SCAN_DELAYS
+        if key not in tables)
+    # Acquisition window itself
+    scan += Get_time(settings, 'Acq. Points')*Get_time(settings, 'Dwell Time')
+
+    # Add the swept delays row by row
+    if tables:
+        rows = min(len(values) for values in tables.values())
+        total = sum(scan + sum(To_seconds(values[i])
+            for values in tables.values())
+            for i in range(rows))
+    else:
+        total = scan*max(int(Get_time(settings, 'Points 2D')), 1)
+
+    return total*max(int(Get_time(settings, 'Scans 1D')), 1)
+
+
+
+def Row_times(settings, tables):
+    '''Estimates the duration of each row of a 2D acquisition in seconds
+        settings, tables: as for Estimate_time'''
+    tables = {key: (value.split(' ') if type(value) == str else value)
+        for key, value in tables.items()}
+    rows = min(len(values) for values in tables.values())
+    return [Estimate_time(settings, {key: [values[i]]
+        for key, values in tables.items()}) for i in range(rows)]
+
+
+
+class Acquisition_waiter():
+    '''Waits for TNMR to finish, sleeps through most of the expected
+        time and then polls with increasing intervals'''
+
+    def __init__(self, app, poll_fast=POLL_FAST, poll_slow=POLL_SLOW,
+            margin=MARGIN):
+        '''Initialization with reference to the TNMR app'''
+        self.app = app
+        self.poll_fast = poll_fast
+        self.poll_slow = poll_slow
+        self.margin = margin
+
+        # Pluggable check, returns True when acquisition is finished
+        self.check = self.Check_app
+        # Functions called with the elapsed time once finished
+        self.callbacks = list()
+
+
+    def Check_app(self):
+        '''Default check, asks the TNMR application'''
+        return self.app.CheckAcquisition
+
+
+    def Wait(self, expected=0):
+        '''Blocks until the acquisition is finished, returns elapsed time
+            expected: estimated duration of the acquisition in seconds'''
+        start = time.time()
+        print('Measurement in progress, expected {:.1f} s'.format(expected))
+
+        # Sleep through the bulk of the acquisition, but check occasionally
+        wake = start + self.margin*expected
+        while True:
+            # Clock read once, the deadline may pass at any point
+            remaining = wake - time.time()
+            if remaining <= 0: break
+            time.sleep(min(self.poll_slow, remaining))
+            if self.check(): break
+
+        # Close to the end, poll fast and back off if the estimate was short
+        poll = self.poll_fast
+        while not self.check():
+            time.sleep(poll)
+            poll = min(2*poll, self.poll_slow)
+
+        elapsed = time.time() - start
+        print('Measurement finished in {:.1f} s'.format(elapsed))
+
+        # Let the orchestrator react immediately
+        for callback in self.callbacks:
+            callback(elapsed)
+
+        return elapsed
+
+
+
+if __name__ == "__main__":
+    # Compare fixed interval polling with the waiter on simulated TNMR
+    import Simulation
+
+    app = Simulation.CreateObject('NTNMR.Application')
+    settings = {
+        'Scans 1D': '4',
+        'Last Delay': '100m',
+        'Acq. Points': '2048',
+        'Dwell Time': '100n',
+        'tau': '35u',
+        'd5': '20m'
+    }
+    print('Estimated: ', Estimate_time(settings))
+
+    for name, interval in [('Fixed 2 s loop', 2), ('Fixed 0.5 s loop', 0.5)]:
+        doc = Simulation.CreateObject('NTNMR.Document')
+        for key, value in settings.items():
+            doc.SetNMRParameter(key, value)
+        start = time.time()
+        doc.ZG()
+        while not app.CheckAcquisition:
+            time.sleep(interval)
+        print(name, 'dead time: ', time.time() - start - doc.acq_time)
+
+    waiter = Acquisition_waiter(app)
+    doc = Simulation.CreateObject('NTNMR.Document')
+    for key, value in settings.items():
+        doc.SetNMRParameter(key, value)
+    doc.ZG()
+    elapsed = waiter.Wait(Estimate_time(settings))
+    print('Waiter dead time: ', elapsed - doc.acq_time)
@@ -0,0 +1,258 @@
+# Analysis of measured points in worker processes, so FID processing
+# and fitting never delay the next acquisition
+
+# Imports
+import queue
+import multiprocessing
+
+import numpy as np  # Numpy for numerical operations
+
+from T1 import ToN
+from FID import FID
+from Fit import Fit_curves
+
+# Global variables
+SLOTS = 8           # Points waiting for analysis at most
+SIZE = 65536        # Largest number of complex points of a point
+
+
+
+def Analyze_point(data, params, settings):
+    '''Default analysis, processed spectrum and its complex integral
+        data: (R, I, R, I, ...) view into shared memory
+        settings: keyword arguments of FID.Process, window in Hz'''
+    fid = FID(params['file_name'], params['file_path'], params)
+    fid.Import_data(data)
+    settings = dict(settings)
+    window = settings.pop('window', None)
+    spectrum = fid.Process(**settings)
+
+    # Complex, so the sign of inverted points can be found later
+    if window is None:
+        mask = slice(None)
+    else:
+        mask = (fid.freq >= window[0]) & (fid.freq <= window[1])
+    step = fid.freq[1] - fid.freq[0]
+    return {
+        'echo': fid.echo,
+        'amplitude': complex(spectrum[..., mask].sum(axis=-1)*step),
+        'peak': float(fid.freq[np.argmax(np.abs(spectrum))])
+    }
+
+
+
+def Signed(amplitudes):
+    '''Real amplitudes with the phase of the strongest point'''
+    amplitudes = np.asarray(amplitudes, dtype=complex)
+    reference = amplitudes[np.argmax(np.abs(amplitudes))]
+    return (amplitudes*np.conj(reference)).real/np.abs(reference)
+
+
+
+def Worker(buffer, slots, size, tasks, results, free, analyze, settings):
+    '''Analysis process, reads points from the shared buffer'''
+    view = np.frombuffer(buffer, dtype=float).reshape(slots, 2*size)
+    for task in iter(tasks.get, None):
+        try:
+            if task[0] == 'point':
+                kind, slot, points, params = task
+                try:
+                    result = analyze(view[slot, :points], params, settings)
+                finally:
+                    # Slot can take the next point
+                    free.put(slot)
+                results.put(('point', params['file_name'], result))
+
+            elif task[0] == 'fit':
+                kind, series, t, y, model = task
+                p, errors = Fit_curves(t, Signed(y)[None, :], model)
+                results.put(('fit', series, (p[0], errors[0])))
+
+        except Exception as e:
+            if task[0] == 'fit':
+                print('Fit of', task[1], 'failed:', repr(e))
+                results.put(('fit', task[1], None))
+            else:
+                results.put(('error', task[3]['file_name'], repr(e)))
+
+
+
+class Analysis_pool():
+    '''Worker processes analysing points handed over through
+        shared memory, the acquisition never waits for them'''
+
+    def __init__(self, workers=None, slots=SLOTS, size=SIZE,
+            analyze=Analyze_point, settings=None):
+        '''Initialization, starts the workers
+            slots: points in shared memory waiting for analysis
+            size: largest number of complex points per point
+            analyze: function(data, params, settings) returning the result
+                of a point, defined at module level so workers can load it
+            settings: passed to analyze, e.g. lb and window'''
+        if workers is None:
+            workers = max(multiprocessing.cpu_count() - 1, 1)
+        self.slots = slots
+        self.size = size
+
+        # Shared between processes without copying, works with Python 3.7
+        self.buffer = multiprocessing.RawArray('d', slots*2*size)
+        self.view = np.frombuffer(self.buffer, dtype=float).reshape(
+            slots, 2*size)
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.free = multiprocessing.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+
+        self.workers = [multiprocessing.Process(target=Worker,
+            args=(self.buffer, slots, size, self.tasks, self.results,
+            self.free, analyze, settings or dict()), daemon=True)
+            for i in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+        # Results by file name and series, fits waiting for points
+        self.points = dict()
+        self.series = dict()
+        self.fits = dict()
+        self.waiting = dict()
+        self.pending = 0
+        self.dropped = 0
+
+
+    def Put(self, data, params, series=None):
+        '''Hands a measured point to the workers, skipped if all
+            slots are busy or the point does not fit in a slot'''
+        self.Poll()
+        data = np.asarray(data, dtype=float)
+        if len(data) > 2*self.size:
+            print('Point too large for analysis:', params['file_name'])
+            self.dropped += 1
+            return False
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            print('Analysis behind, skipping', params['file_name'])
+            self.dropped += 1
+            return False
+
+        self.view[slot, :len(data)] = data
+        self.tasks.put(('point', slot, len(data), dict(params)))
+        self.pending += 1
+        if series is not None:
+            self.series.setdefault(series, list()).append(dict(params))
+        return True
+
+
+    def Fit(self, series, key, model='exp'):
+        '''Fits the points of series against params[key] once they
+            are analysed'''
+        self.waiting[series] = (key, model)
+        self.Poll()
+
+
+    def Poll(self):
+        '''Collects finished results and starts waiting fits'''
+        while True:
+            try:
+                self.Collect(self.results.get_nowait())
+            except queue.Empty:
+                break
+        self.Start_fits()
+
+
+    def Collect(self, message):
+        '''Stores a result sent by a worker'''
+        kind, name, result = message
+        self.pending -= 1
+        if kind == 'point':
+            self.points[name] = result
+        elif kind == 'fit':
+            self.fits[name] = result
+        else:
+            print('Analysis of', name, 'failed:', result)
+            self.points[name] = None
+
+
+    def Start_fits(self):
+        '''Queues fits of series with all points analysed'''
+        for series, (key, model) in list(self.waiting.items()):
+            points = self.series.get(series, list())
+            names = [params['file_name'] for params in points]
+            if not all(name in self.points for name in names):
+                continue
+            # Points that could not be analysed are left out
+            points = [params for params in points
+                if self.points[params['file_name']] is not None]
+            del self.waiting[series]
+            if len(points) < 3:
+                print('Too few points to fit', series)
+                continue
+            t = np.array([ToN(params[key]) for params in points])
+            y = np.array([self.points[params['file_name']]['amplitude']
+                for params in points])
+            self.tasks.put(('fit', series, t, y, model))
+            self.pending += 1
+
+
+    def Wait(self, timeout=None):
+        '''Blocks until all points and fits are analysed'''
+        self.Poll()
+        while self.pending > 0:
+            try:
+                self.Collect(self.results.get(timeout=timeout))
+            except queue.Empty:
+                break
+            self.Start_fits()
+
+
+    def Close(self):
+        '''Finishes the queued analysis and stops the workers'''
+        self.Wait()
+        for worker in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, e_type, e_value, e_traceback):
+        self.Close()
+
+
+
+if __name__ == "__main__":
+    # T1 sweep on simulated TNMR with heavy analysis in the workers
+    import io
+    import os
+    import time
+    import tempfile
+    import contextlib
+
+    import Simulation
+    from TNMR_legacy import Tecmag
+
+    A = Tecmag(simulate=True)
+    A.Test_params()
+    A.params['file_path'] = tempfile.mkdtemp() + os.sep
+    os.mkdir(A.params['file_path'] + 'export\\')
+    A.params.update({'NS': '4', 'D9': '20m', 'D5min': '10u', 'D5max': '50m',
+        'D5N': '16', 'TD': '4096', 'file_name': 'T1-analysis'})
+    Simulation.Configure(T1=0.005)
+
+    # Zero filling to 2**20 points makes each point slow to analyse
+    A.analysis = Analysis_pool(slots=4, size=4096,
+        settings={'lb': 1000, 'size': 2**20})
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        A.Get_T1(A.params, single=False)
+    print('Sweep finished in {:.2f} s'.format(time.time() - start))
+    A.analysis.Close()
+    print('Analysis finished after {:.2f} s'.format(time.time() - start))
+
+    p, errors = A.analysis.fits['T1-analysis']
+    print('T1 set {:.3g} s, fitted {:.3g} +- {:.2g} s, {} skipped'.format(
+        Simulation.SETTINGS['T1'], p[2], errors[2], A.analysis.dropped))
@@ -0,0 +1,236 @@
+# Benchmarks of sweeps, export and import on the simulated TNMR,
+# results are written to a JSON file and compared with the last run
+
+# Imports
+import io
+import os
+import sys
+import json
+import time
+import timeit
+import platform
+import tempfile
+import contextlib
+
+import numpy as np  # Numpy for numerical operations
+
+import Simulation
+import Units
+from T1 import ToN
+from T1 import Geometric_list
+from NMR7 import Legacy_export
+from FID import FID
+from TNMR_legacy import Tecmag
+
+# Global variables
+BENCHMARK_FILE = 'benchmark.json'
+TOLERANCE = 0.2     # Relative slowdown reported as a regression
+REPEAT = 5          # Sweeps run for the median
+# Slowdowns below these seconds are noise, whatever the relative change
+FLOORS = {
+    'idle_per_point': 0.002,
+    'seconds': 0.005,
+    'micro': 0.00005
+}
+
+
+
+def Temporary_params(tecmag):
+    '''Test params writing into a new temporary directory'''
+    tecmag.Test_params()
+    params = tecmag.params
+    params['file_path'] = tempfile.mkdtemp() + os.sep
+    os.mkdir(params['file_path'] + 'export\\')
+    return params
+
+
+
+def Sweep(kind, single=True, points=32, latency=0.0005, repeat=REPEAT):
+    '''Median of repeat sweeps with Sweep_once'''
+    runs = [Sweep_once(kind, single, points, latency) for i in range(repeat)]
+    result = {key: float(np.median([run[key] for run in runs]))
+        for key in runs[0] if key != 'calls'}
+    result['points'] = points
+    result['repeat'] = repeat
+    result['calls'] = runs[0]['calls']
+    return result
+
+
+
+def Sweep_once(kind, single=True, points=32, latency=0.0005):
+    '''Times a full Get_T1 or Get_T2 sweep, counts COM calls and
+        the time the instrument was not acquiring'''
+    Simulation.Configure(latency=latency)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tecmag = Tecmag(simulate=True)
+    params = Temporary_params(tecmag)
+    params.update({'file_name': kind + '-bench', 'NS': '2', 'D9': '10m',
+        'D5min': '10u', 'D5max': '10m', 'D5N': str(points),
+        'TAUN': str(points)})
+
+    first = len(tecmag.app.acquisitions)
+    Simulation.Reset_calls()
+    # Keep the progress prints out of the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.time()
+        if kind == 'T1':
+            tecmag.Get_T1(params, single)
+        else:
+            tecmag.Get_T2(params, single)
+        wall = time.time() - start
+    calls = Simulation.Reset_calls()
+    tecmag.Close()
+
+    acquiring = float(sum(stop - begin
+        for begin, stop in tecmag.app.acquisitions[first:]))
+    idle = wall - acquiring
+    return {
+        'points': points,
+        'wall': wall,
+        'acquiring': acquiring,
+        'idle': idle,
+        'idle_per_point': idle/points,
+        'com_calls': sum(calls.values()),
+        'com_calls_per_point': sum(calls.values())/points,
+        'calls': calls
+    }
+
+
+
+def Export_throughput(sizes=(1024, 4096, 16384, 65536), repeat=10):
+    '''Times Legacy_export of a single FID for each TD'''
+    tecmag = Tecmag(simulate=True)
+    params = Temporary_params(tecmag)
+    tecmag.INV_params(params)
+    params.update({'file_name': 'export-bench', 'DATESTA': '01.01.2021',
+        'TIMESTA': '00:00:00', 'TIMEEND': '00:00:01'})
+
+    results = dict()
+    for td in sizes:
+        params['TD'] = str(td)
+        data = tuple(np.random.normal(0, 1000, 2*td).tolist())
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds = min(timeit.repeat(lambda: Legacy_export(data, params),
+                number=1, repeat=repeat))
+        results[str(td)] = {
+            'seconds': seconds,
+            'points_per_second': td/seconds
+        }
+    return results
+
+
+
+def Import_files(points=16384, rows=32, repeat=5):
+    '''Times FID.Import_file on a 1D and Import_file_nD on a
+        2D file exported by the simulated TNMR'''
+    file_dir = tempfile.mkdtemp()
+    doc = Simulation.CreateObject('NTNMR.Document')
+    doc.SetNMRParameter('Acq. Points', str(points))
+
+    results = dict()
+    for name, size in [('1D', 1), ('2D', rows)]:
+        file_name = 'import_{}.txt'.format(name)
+        doc.SetNMRParameter('Points 2D', str(size))
+        doc.Export(os.path.join(file_dir, file_name), 0)
+
+        fid = FID(file_name, file_dir)
+        method = fid.Import_file if size == 1 else fid.Import_file_nD
+        with contextlib.redirect_stdout(io.StringIO()):
+            seconds = min(timeit.repeat(method, number=1, repeat=repeat))
+        results[name] = {
+            'points': points*size,
+            'seconds': seconds,
+            'points_per_second': points*size/seconds
+        }
+    return results
+
+
+
+def Micro(number=1000, repeat=7):
+    '''Microbenchmarks of delay list generation and value parsing,
+        seconds per call'''
+    d5_list = Geometric_list('10u', '1s', 200).Strings()
+
+    def Parse_cold():
+        Units.ToN.cache_clear()
+        return [ToN(d5) for d5 in d5_list]
+
+    tests = {
+        'Geometric_list_200': lambda: Geometric_list('10u', '1s', 200),
+        'ToN_200_cold': Parse_cold,
+        'ToN_200_cached': lambda: [ToN(d5) for d5 in d5_list],
+        'To_array_200': lambda: Units.To_array(d5_list)
+    }
+    return {name: min(timeit.repeat(test, number=number,
+        repeat=repeat))/number for name, test in tests.items()}
+
+
+
+def Run_all():
+    '''Runs all benchmarks, returns results with system information'''
+    results = {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform()
+    }
+    for kind in ['T1', 'T2']:
+        for single in [True, False]:
+            name = 'sweep_{}_{}'.format(kind, '2D' if single else 'points')
+            print('Running', name)
+            results[name] = Sweep(kind, single)
+    print('Running export')
+    results['legacy_export'] = Export_throughput()
+    print('Running import')
+    results['fid_import'] = Import_files()
+    print('Running micro')
+    results['micro'] = Micro()
+    return results
+
+
+
+def Compare(results, previous, tolerance=TOLERANCE, path=''):
+    '''Lists timings slower than in the previous results, dead time per
+        point and seconds per call are compared. A slowdown has to exceed
+        both the relative tolerance and the absolute FLOORS'''
+    regressions = list()
+    for key, value in results.items():
+        if key not in previous:
+            continue
+        name = path + key
+        if type(value) == dict:
+            regressions += Compare(value, previous[key], tolerance,
+                name + '.')
+            continue
+        if path.startswith('micro.'):
+            floor = FLOORS['micro']
+        elif key in FLOORS:
+            floor = FLOORS[key]
+        else:
+            continue
+        if value > (1 + tolerance)*previous[key] + floor:
+            regressions.append((name, previous[key], value))
+    return regressions
+
+
+
+if __name__ == "__main__":
+    file_path = sys.argv[1] if len(sys.argv) > 1 else BENCHMARK_FILE
+    results = Run_all()
+
+    for key, value in results.items():
+        if type(value) == dict and 'idle_per_point' in value:
+            print('{}: {:.2f} s, idle {:.1f} ms/point, {:.1f} COM calls/point'
+                .format(key, value['wall'], 1000*value['idle_per_point'],
+                value['com_calls_per_point']))
+
+    # Compare with the last run before replacing it
+    if os.path.isfile(file_path):
+        with open(file_path) as f:
+            previous = json.load(f)
+        for name, old, new in Compare(results, previous):
+            print('Regression {}: {:.3g} -> {:.3g}'.format(name, old, new))
+
+    with open(file_path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results written to', file_path)
@@ -0,0 +1,112 @@
+# Compact binary export of FIDs next to the 7NMR .DAT files
+#
+# File layout:
+#   8 bytes     magic b'TNMRFID1'
+#   4 bytes     header length, little endian unsigned int
+#   header      JSON with dtype, shape and the 7NMR parameter sections,
+#               padded with spaces so the data starts at a multiple of 16
+#   data        raw little endian complex array, normalized by NS
+
+# Imports
+import os
+import json
+import struct
+import numpy as np  # Numpy for numerical operations
+
+from T1 import ToN
+from NMR7 import Legacy_export
+from NMR7 import Legacy_params
+from NMR7 import Export_params
+
+# Global variables
+MAGIC = b'TNMRFID1'
+ALIGN = 16  # Data offset alignment in bytes
+
+
+
+def Binary_export(data, params, dtype=np.complex64):
+    '''Takes the data and parameters and exports binary FID'''
+    file_path = params['file_path'] + 'export\\'
+    file_name = params['file_name'] + '.BIN'
+
+    print('Writing to file: ', os.path.join(file_path, file_name))
+    params = Export_params(params)
+
+    # data format: (R, I, R, I, ...) normalized by number of scans
+    points = int(params['TD'])
+    values = np.asarray(data, dtype='<f8')[:2*points] / int(params['NS'])
+    values = values.view('<c16').astype(np.dtype(dtype).newbyteorder('<'))
+
+    # Same sections as in the .DAT file
+    L = Legacy_params()
+    header = {
+        'dtype': values.dtype.str,
+        'shape': list(values.shape),
+        'PARAMETERS': {key: ToN(params[value])
+            for key, value in L.PARAMETERS.items()},
+        'ADDITIONAL': {key: params[value]
+            for key, value in L.ADDITIONAL.items()},
+        'VARIABLES': {key: params[value]
+            for key, value in L.VARIABLES.items()}
+    }
+    text = json.dumps(header).encode('utf-8')
+    # Pad so data is aligned
+    text += b' '*(-(len(MAGIC) + 4 + len(text)) % ALIGN)
+
+    with open(os.path.join(file_path, file_name), 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(text)))
+        f.write(text)
+        f.write(values.tobytes())
+
+    print('File writing complete')
+
+
+
+def Binary_import(file_path):
+    '''Reads header of a binary FID and maps its data without parsing,
+        returns header dictionary and complex numpy memmap'''
+    with open(file_path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a binary FID file: ' + file_path)
+        length = struct.unpack('<I', f.read(4))[0]
+        header = json.loads(f.read(length).decode('utf-8'))
+
+    data = np.memmap(file_path, dtype=header['dtype'], mode='r',
+        offset=len(MAGIC) + 4 + length, shape=tuple(header['shape']))
+    return header, data
+
+
+
+def Export_all(data, params):
+    '''Exports to 7NMR .DAT and binary FID'''
+    Legacy_export(data, params)
+    Binary_export(data, params)
+
+
+
+if __name__ == "__main__":
+    # Write both formats and compare size and reading
+    import tempfile
+
+    params = {
+        'file_path': tempfile.mkdtemp() + os.sep,
+        'file_name': 'test',
+        'DW': '100n', 'TAU': '35u', 'TD': '2048', 'NS': '256', 'FR': '24.88',
+        'D9': '1s', 'd123': '3u', 'D5': '10u', 'pulse_file': 'test.tps',
+        'DATESTA': '01.01.2021', 'TIMESTA': '00:00:00', 'TIMEEND': '00:00:01',
+        'a123': '28', 'atn1': '19', 'atn23': '13', 'RecGain': '25',
+        'RecPh': '155', 'Filter': '100000', 'Pcryo': '660m', 'ad': '30u',
+        'rd': '3u', 'pre': '3u', 'Tset': '10.0', 'Tsens': '10.0',
+        'Tprobe': '10.05', 'Fpers': '2.1'
+    }
+    os.mkdir(params['file_path'] + 'export\\')
+    data = tuple(np.random.normal(0, 1e6, 2*int(params['TD'])))
+    Export_all(data, params)
+
+    base = os.path.join(params['file_path'] + 'export\\', params['file_name'])
+    print('Size .DAT: ', os.path.getsize(base + '.DAT'),
+        '.BIN: ', os.path.getsize(base + '.BIN'))
+    header, fid = Binary_import(base + '.BIN')
+    print(header['PARAMETERS'], fid.dtype, fid.shape,
+        np.allclose(fid, (np.array(data[0::2]) + 1j*np.array(data[1::2]))/256))
@@ -0,0 +1,105 @@
+# Choosing D5 delays for a T1 measurement from a prior T1 estimate
+
+# Imports
+import numpy as np  # Numpy for numerical operations
+
+from T1 import ToN
+from T1 import Truncate
+from T1 import Delay_list
+from Fit import MODELS
+from Fit import Gradient
+
+# Global variables
+CANDIDATES = 200    # Number of log spaced delays to choose from
+SNR = '20'          # Signal to noise of a single point if not in params
+EXTRA_POINTS = 2    # Points beyond the number of fit parameters at least
+
+
+
+def Point_cost(d5, params):
+    '''Time in seconds to measure one point with delay d5'''
+    return int(params['NS'])*(ToN(params['D9']) + d5)
+
+
+
+def Variance(G, noise, index):
+    '''Variance of parameter index, e.g. T1, from gradients G
+        of the measured points'''
+    information = G.T @ G/noise**2
+    return np.linalg.pinv(information)[index, index]
+
+
+
+def Optimal_list(params, t1, precision=0.05, snr=None, model='exp',
+        shuffle=True, max_points=None):
+    '''Generates the d5 values reaching the relative T1 precision
+        in the shortest total time
+        t1: prior estimate of T1
+        model: inversion recovery model from Fit.MODELS
+        snr: signal to noise of a single point at NS scans,
+            params['T1snr'] if None'''
+    # Converts if input data are strings
+    if type(t1) == str:
+        t1 = ToN(t1)
+    if snr is None:
+        snr = params.get('T1snr') or SNR
+    if type(snr) == str:
+        snr = ToN(snr)
+    start = ToN(params['D5min'])
+    stop = ToN(params['D5max'])
+    names = MODELS[model][1]
+    index = names.index('T1')
+    # Leave degrees of freedom for the fit
+    min_points = len(names) + EXTRA_POINTS
+    if max_points is None:
+        max_points = 4*int(params['D5N'])
+    max_points = max(max_points, min_points)
+
+    # Relaxation with the prior T1, amplitudes relative to M0
+    p = np.array([1., 2., t1, 1.][:len(names)])
+    candidates = np.geomspace(start, stop, CANDIDATES)
+    G = Gradient(candidates, p, model)
+    cost = np.array([Point_cost(d5, params) for d5 in candidates])
+    noise = 1/snr
+
+    # Start with both ends and the point closest to T1
+    chosen = [0, int(np.argmin(np.abs(np.log(candidates/t1)))),
+        CANDIDATES - 1]
+    chosen = sorted(set(chosen))
+    variance = Variance(G[chosen], noise, index)
+
+    # Add the point with the best precision gain per second
+    while ((np.sqrt(variance)/t1 > precision or len(chosen) < min_points)
+            and len(chosen) < max_points):
+        # Below the minimum any point is better than none
+        best, best_variance = None, variance
+        best_gain = 0 if len(chosen) >= min_points else -np.inf
+        for i in range(CANDIDATES):
+            if i in chosen: continue
+            trial = Variance(G[chosen + [i]], noise, index)
+            gain = (variance - trial)/cost[i]
+            if gain > best_gain:
+                best, best_variance, best_gain = i, trial, gain
+        if best is None: break
+        chosen.append(best)
+        variance = best_variance
+
+    print('Predicted T1 precision: {:.3g}, points: {}, time: {:.1f} s'.format(
+        np.sqrt(variance)/t1, len(chosen), cost[chosen].sum()))
+
+    # Same formatting as Geometric_list
+    delays = Delay_list(Truncate(np.sort(candidates[chosen])))
+    if shuffle:
+        delays = delays.Interleave()
+    return delays
+
+
+
+if __name__ == "__main__":
+    params = {'D5min': '10u', 'D5max': '1s', 'D5N': '20',
+        'NS': '256', 'D9': '1s', 'T1snr': '20'}
+    for t1 in ['100u', '10m']:
+        print(Optimal_list(params, t1))
+    # Loose target, still enough points for the fit
+    params['T1snr'] = '1000'
+    print(Optimal_list(params, '10m', precision=0.5))
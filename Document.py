@@ -0,0 +1,150 @@
+# Wrappers around TNMR documents reducing the number of COM calls
+
+# Imports
+import math # For comparing floats
+from collections import OrderedDict # Documents in order of use
+
+from T1 import ToN
+
+
+
+def Normalize(value):
+    '''Converts parameter value to a comparable form,
+        numbers with suffixes become floats, other strings stay'''
+    try:
+        return ToN(value.strip())
+    except (AttributeError, ValueError):
+        return value
+
+
+
+def Same_value(a, b):
+    '''Compares two normalized parameter values'''
+    if type(a) == float and type(b) == float:
+        return math.isclose(a, b, rel_tol=1e-12, abs_tol=1e-15)
+    return a == b
+
+
+
+class Cached_document():
+    '''Wraps a TNMR document and remembers the parameters written to it,
+        SetNMRParameter is only sent when the value changes'''
+
+    def __init__(self, doc):
+        '''Initialization with reference to the TNMR document'''
+        self.doc = doc
+        # Where the document was last saved
+        self.path = ''
+        # Last written normalized value for each parameter
+        self.values = dict()
+        # Tables set since the pulse program was loaded
+        self.tables = set()
+        # Counters of issued and skipped writes
+        self.writes = 0
+        self.skipped = 0
+
+
+    def __getattr__(self, name):
+        '''Everything else goes directly to the document'''
+        return getattr(self.doc, name)
+
+
+    def SetNMRParameter(self, key, value):
+        '''Sets parameter in the document if it changed'''
+        normal = Normalize(value)
+        if key in self.values and Same_value(self.values[key], normal):
+            self.skipped += 1
+            return True
+
+        result = self.doc.SetNMRParameter(key, value)
+        self.values[key] = normal
+        self.writes += 1
+        return result
+
+
+    def SetTable(self, key, value):
+        '''Sets a table of swept values and remembers it'''
+        self.tables.add(key)
+        return self.doc.SetTable(key, value)
+
+
+    def LoadSequence(self, path):
+        '''Loads pulse program, which resets the parameters and tables'''
+        self.Invalidate()
+        self.tables.clear()
+        return self.doc.LoadSequence(path)
+
+
+    def SaveAs(self, path):
+        '''Saves the document and remembers where'''
+        self.path = path
+        return self.doc.SaveAs(path)
+
+
+    def Invalidate(self, key=None):
+        '''Forgets the written value of key or of all parameters'''
+        if key is None:
+            self.values.clear()
+        else:
+            self.values.pop(key, None)
+
+
+
+class Document_pool():
+    '''Keeps documents with loaded pulse programs open in TNMR,
+        so consecutive measurements skip creating and loading'''
+
+    def __init__(self, app, create, size=2):
+        '''Initialization with reference to TNMR app, function creating
+            COM objects and the number of idle documents kept open'''
+        self.app = app
+        self.create = create
+        self.size = size
+        # Idle documents by pulse program, least recently used first
+        self.idle = OrderedDict()
+        # Counters of created and reused documents
+        self.created = 0
+        self.reused = 0
+
+
+    def Acquire(self, sequence):
+        '''Returns a document with the pulse program loaded'''
+        if sequence in self.idle:
+            self.reused += 1
+            return self.idle.pop(sequence)
+
+        self.created += 1
+        doc = Cached_document(self.create('NTNMR.Document'))
+        doc.LoadSequence(sequence)
+        return doc
+
+
+    def Release(self, sequence, doc):
+        '''Returns the document for reuse, closes the oldest if full'''
+        if doc.tables:
+            # Tables would override the delays of the next measurement
+            doc.LoadSequence(sequence)
+        if sequence in self.idle:
+            # Only one idle document per pulse program
+            self.Close_document(self.idle.pop(sequence))
+        self.idle[sequence] = doc
+
+        while len(self.idle) > self.size:
+            self.Close_document(self.idle.popitem(last=False)[1])
+
+
+    def Close_document(self, doc):
+        '''Closes a document in TNMR'''
+        if doc.path:
+            closed = self.app.CloseFile(doc.path)
+        else:
+            # Never saved, an empty path would close the active document
+            closed = doc.Close()
+        if not closed:
+            print('Failed to close file', doc.path or 'without name')
+
+
+    def Close(self):
+        '''Closes all idle documents'''
+        while self.idle:
+            self.Close_document(self.idle.popitem(last=False)[1])
@@ -1,12 +1,104 @@
 ''' Routines for importing an FID from .txt or direct transfer '''
 # Imports
 import os # For compiling directory paths
+import itertools    # For reading rows of lines
+from functools import lru_cache # For windows, phases and axes
 import numpy as np  # Numpy for numerical operations
 
 import matplotlib   # Plotting
 import matplotlib.pyplot as plt     # Short notation for plots
 
+from T1 import ToN
+
 # Global variables
+CACHE_SIZE = 64     # Windows, phases and axes kept for reuse
+
+
+
+def Read_heads(f):
+    '''Reads header of an open TNMR text file up to the first empty line,
+        returns header lines and the 1D 2D 3D 4D depths'''
+    # get the head strings using the first empty line
+    heads = list()
+    line = f.readline()
+    while line.strip() != '':
+        heads.append(line.strip())
+        line = f.readline()
+
+    # Find the 1D 2D 3D 4D depths, skip first and last row
+    depths = [int(value.split('\t')[-1]) for value in heads[1:-1]]
+    return heads, depths
+
+
+
+def Parse_block(text):
+    '''Parses lines of real and imaginary columns into complex array'''
+    # Parse all numbers at once, columns from the first data line
+    columns = len(text.split('\n', 1)[0].split())
+    values = np.fromstring(text, sep=' ').reshape(-1, columns)
+
+    # Real and imaginary columns as complex
+    if columns == 2:
+        return values.reshape(-1).view(complex)
+    return values[:, 0] + 1j*values[:, 1]
+
+
+
+def Read_only(vector):
+    '''Protects a cached vector from changes'''
+    vector.flags.writeable = False
+    return vector
+
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def Apodize_window(td, dw, lb):
+    '''Exponential window of lb Hz'''
+    return Read_only(np.exp(-np.pi*lb*dw*np.arange(td)))
+
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def Frequency_axis(td, dw):
+    '''Frequency axis of the shifted spectrum in Hz'''
+    return Read_only(np.fft.fftshift(np.fft.fftfreq(td, dw)))
+
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def Phase_vector(td, dw, ph0, ph1):
+    '''Zero and first order phase correction in degrees'''
+    freq = Frequency_axis(td, dw)
+    width = freq[-1] - freq[0]
+    return Read_only(np.exp(1j*np.radians(ph0 + ph1*freq/width)))
+
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def Integral_mask(td, dw, low, high):
+    '''Points of the spectrum between low and high Hz'''
+    freq = Frequency_axis(td, dw)
+    return Read_only((freq >= low) & (freq <= high))
+
+
+
+def As_complex(data):
+    '''Views data in format (R, I, R, I, ...) as complex numpy array,
+        float arrays are used without copying, tuples copied once'''
+    values = np.ascontiguousarray(data, dtype=float)
+    return values.reshape(-1).view(complex)
+
+
+
+def Read_text(file_path):
+    '''Reads a TNMR text file, returns header lines, depths
+        and complex data as a flat numpy array'''
+    with open(file_path) as f:
+        heads, depths = Read_heads(f)
+        # Numeric block ends at the next empty line
+        text = f.read().split('\n\n', 1)[0]
+
+    return heads, depths, Parse_block(text)
 
 
 
@@ -18,7 +110,7 @@ class FID():
         self.file_name = file_name
         self.file_dir = file_dir
         # Try to accept given params
-        if not params:
+        if params:
             self.params = params
         else:
             self.params = dict()
@@ -26,131 +118,221 @@ class FID():
     
     def Import_file(self):
         '''Imports data from a TNMR text file assumes 1D for FID'''
-        with open(os.path.join(self.file_dir, self.file_name)) as f:
-            lines = list(f)
-
-        # strip /n from end of line
-        lines = [line.strip() for line in lines]
-
-        # get the head strings using the first empty line
-        heads = list()
-        while len(lines) > 0:
-            line = lines.pop(0)
-            if line == '': break # Stop after empty line
-            heads.append(line)
-        print('Heads: ', heads)
+        self.heads, self.depths, data = Read_text(
+            os.path.join(self.file_dir, self.file_name))
+        print('Heads: ', self.heads)
 
         # Find the 1D 2D 3D 4D depths
-        self.depths = list()
-        for value in heads[1:-1]: # Skip first and last row
-            self.depths.append(int(value.split('\t')[-1]))
         dimension = len(self.depths)
         print('Dimension: ', dimension)
         if not dimension == 1: # Fix the 1D case
             print('Was not given a 1D file! Taking only first case')
 
-        # Assume 1D
-        self.x1_list = []
-        self.x2_list = []
-
-        # Extract the data
-        for i in range(depths[0]):
-            split = lines[i].split('\t')
-            self.x1_list.append(float(split[0]))
-            self.x2_list.append(float(split[1]))
-            
-        # Make a complex numpy array
-        self.x_list = ( np.array(self.x1_list[i]) 
-            + 1j*np.array(self.x2_list[i]) )
+        # Assume 1D, complex numpy array
+        self.x_list = data.reshape(-1, self.depths[0])[0]
+        self.x1_list = self.x_list.real
+        self.x2_list = self.x_list.imag
+        self.Reset()
 
         # Dont have the params....
 
 
-    # Dont use for FID
-"""
     def Import_file_nD(self):
-        '''Imports data from a TNMR text file'''
-        with open(os.path.join(self.file_dir, self.file_name)) as f:
-            lines = list(f)
+        '''Imports data from a TNMR text file, x_list has shape
+            (depth2, depth1) or with more dimensions (depth4, ..., depth1)'''
+        self.heads, self.depths, data = Read_text(
+            os.path.join(self.file_dir, self.file_name))
+        print('Heads: ', self.heads)
 
-        # strip /n from end of line
-        lines = [line.strip() for line in lines]
-
-        # get the head strings using the first empty line
-        heads = list()
-        while len(lines) > 0:
-            line = lines.pop(0)
-            if line == '': break # Stop after empty line
-            heads.append(line)
-        print('Heads: ', heads)
-
-        # Find the 1D 2D 3D 4D depths
-        self.depths = list()
-        for value in heads[1:-1]: # Skip first and last row
-            self.depths.append(int(value.split('\t')[-1]))
         dimension = len(self.depths)
         print('Dimension: ', dimension)
         if dimension == 1: # Fix the 1D case
             self.depths.append(1)
 
-        # Assume 2D
-        self.x1_list = [[] for i in range(self.depths[1])]
-        self.x2_list = [[] for i in range(self.depths[1])]
-
-        # Extract the data
-        for i,line in enumerate(lines):
-            if line == '': break # Stop after empty line
-            split = line.split('\t')
-            self.x1_list[i//self.depths[0]].append(float(split[0]))
-            self.x2_list[i//self.depths[0]].append(float(split[1]))
-            
-        # Make a complex numpy array
-        self.x_list = [
-            np.array(self.x1_list[i]) + 1j*np.array(self.x2_list[i])
-            for i in range(self.depths[1])
-            ]
+        # Contiguous complex numpy array, last index runs over 1D points
+        self.x_list = data.reshape(tuple(reversed(self.depths)))
+        self.x1_list = self.x_list.real
+        self.x2_list = self.x_list.imag
+        self.Reset()
 
         # Dont have the params....
-"""
 
 
-    def Import_data(self, data, params=None):
-        '''Imports FID from techmag directly
-        Assumes single FID'''
-        # Update parameter dictionary with given values
-        if not params:
-            self.params.update(params)
+    def Iter_rows(self):
+        '''Yields the 1D rows of a TNMR text file one at a time,
+            so the whole nD data never has to be in memory'''
+        with open(os.path.join(self.file_dir, self.file_name)) as f:
+            self.heads, self.depths = Read_heads(f)
 
-        # data format: tuple of floats (R, I, R, I, R, I, ...)
+            # Number of 1D rows in all higher dimensions
+            rows = 1
+            for depth in self.depths[1:]:
+                rows *= depth
 
-        self.x1_list = []
-        self.x2_list = []
+            for i in range(rows):
+                lines = ''.join(itertools.islice(f, self.depths[0]))
+                if lines.strip() == '': break # Data ended early
+                yield Parse_block(lines)
 
-        # Split real and imaginary
-        for i in range(len(data)//2):
-            self.x1_list.append(data[2*i])
-            self.x2_list.append(data[2*i+1])
+
+    def Import_data(self, data, params=None, size=None):
+        '''Imports FID from techmag directly
+            size: GetDataSize of the document, 1D points first,
+                rows of 2D data are reshaped into x_list[row]'''
+        # Update parameter dictionary with given values
+        if params:
+            self.params.update(params)
 
         # Make a complex numpy array
-        self.x_list = ( np.array(self.x1_list[i]) 
-            + 1j*np.array(self.x2_list[i]) )
+        self.x_list = As_complex(data)
+
+        # Sizes of higher dimensions, drop unused trailing ones
+        if size is not None and not np.isscalar(size):
+            self.depths = [int(depth) for depth in size]
+            while len(self.depths) > 1 and self.depths[-1] <= 1:
+                self.depths.pop()
+            if len(self.depths) > 1:
+                self.x_list = self.x_list.reshape(
+                    tuple(reversed(self.depths)))
+        self.x1_list = self.x_list.real
+        self.x2_list = self.x_list.imag
+        self.Reset()
+
+
+    def Dwell_time(self, dw=None):
+        '''Dwell time in seconds, from params if not given'''
+        if dw is None:
+            dw = self.params['DW']
+        return ToN(dw) if type(dw) == str else dw
+
+
+    def Reset(self):
+        '''Starts processing again from the imported data, x_list
+            is never changed by the processing steps'''
+        self.y_list = self.x_list
+
+
+    def Shift(self, points=None):
+        '''Shifts all rows to start at the echo top, pads zeros at the end
+            points: number of points to drop, found from magnitude if None'''
+        if points is None:
+            # Echo top of the summed magnitude of all rows
+            magnitude = np.abs(self.y_list).reshape(-1, self.y_list.shape[-1])
+            points = int(np.argmax(magnitude.sum(axis=0)))
+
+        shifted = np.zeros_like(self.y_list)
+        shifted[..., :self.y_list.shape[-1] - points] = self.y_list[..., points:]
+        self.y_list = shifted
+        self.echo = points
+        return points
+
+
+    def Apodize(self, lb, dw=None):
+        '''Exponential line broadening of lb Hz'''
+        td = self.y_list.shape[-1]
+        self.y_list = self.y_list*Apodize_window(td, self.Dwell_time(dw), lb)
+
+
+    def Zero_fill(self, size):
+        '''Pads rows with zeros to size points'''
+        td = self.y_list.shape[-1]
+        if size > td:
+            filled = np.zeros(self.y_list.shape[:-1] + (size,), dtype=complex)
+            filled[..., :td] = self.y_list
+            self.y_list = filled
+
+
+    def FFT(self, dw=None):
+        '''Fourier transforms all rows, frequency axis in Hz'''
+        self.dw = self.Dwell_time(dw)
+        self.freq = Frequency_axis(self.y_list.shape[-1], self.dw)
+        self.spectrum = np.fft.fftshift(np.fft.fft(self.y_list, axis=-1),
+            axes=-1)
+        return self.spectrum
+
+
+    def Phase(self, ph0, ph1=0):
+        '''Zero and first order phase of the spectrum in degrees,
+            ph1 is the phase change across the whole spectrum'''
+        self.spectrum = self.spectrum*Phase_vector(self.spectrum.shape[-1],
+            self.dw, ph0, ph1)
+
+
+    def Integrate(self, low, high):
+        '''Integrates real part of the spectrum between low and high Hz,
+            returns one value per row'''
+        window = Integral_mask(self.spectrum.shape[-1], self.dw, low, high)
+        step = self.freq[1] - self.freq[0]
+        return self.spectrum[..., window].real.sum(axis=-1)*step
+
+
+    def Process(self, lb=0, size=None, ph0=0, ph1=0, window=None,
+            shift=True, dw=None):
+        '''Shift, apodization, zero fill, FFT and phase of all rows at once,
+            always starting from the imported x_list
+            window: (low, high) in Hz, returns integrals if given'''
+        self.Reset()
+        if shift is True:
+            self.Shift()
+        elif shift:
+            self.Shift(shift)
+        if lb:
+            self.Apodize(lb, dw)
+        if size:
+            self.Zero_fill(size)
+        self.FFT(dw)
+        if ph0 or ph1:
+            self.Phase(ph0, ph1)
+        if window is not None:
+            return self.Integrate(*window)
+        return self.spectrum
+
 
 
-       
 if __name__ == "__main__":
     '''Executes if executed directly'''
+    # Time reading synthetic files against line by line parsing
+    import tempfile
+    import time
+
+    for points in [2048, 65536]:
+        file_dir = tempfile.mkdtemp()
+        file_name = 'bench_{}.txt'.format(points)
+        values = np.random.normal(0, 1e3, (points, 2))
+        with open(os.path.join(file_dir, file_name), 'w') as f:
+            f.write('TNMR text export\nPoints 1D\t{}\nReal\tImaginary\n\n'.format(
+                points))
+            f.write('\n'.join('{:f}\t{:f}'.format(*row) for row in values))
+
+        start = time.time()
+        with open(os.path.join(file_dir, file_name)) as f:
+            lines = [line.strip() for line in f][4:]
+        x1_list = [float(line.split('\t')[0]) for line in lines]
+        x2_list = [float(line.split('\t')[1]) for line in lines]
+        reference = np.array(x1_list) + 1j*np.array(x2_list)
+        loop = time.time() - start
+
+        start = time.time()
+        A = FID(file_name, file_dir)
+        A.Import_file()
+        bulk = time.time() - start
+
+        print('{} points: equal {}, lists {:.1f} ms, bulk {:.1f} ms'.format(
+            points, np.array_equal(A.x_list, reference),
+            1000*loop, 1000*bulk))
+
     # testing of script
     file_dir = 'C:\\TNMR\\data\\Nejc test\\Cu NQR\\Pulsing'
     file_name = '201001_FID.txt'
 
-    A = FID(file_name, file_dir)
-    A.Import_file()
+    if os.path.isdir(file_dir):
+        A = FID(file_name, file_dir)
+        A.Import_file()
 
     # Higher dimension
     file_dir2 = 'C:\\TNMR\\data\\Nejc test\\Cu NQR'
     file_name2 = 'test_T1.txt'
 
-    B = FID(file_name2, file_dir2)
-    B.Import_file()
-
-
+    if os.path.isdir(file_dir2):
+        B = FID(file_name2, file_dir2)
+        B.Import_file_nD()
@@ -0,0 +1,326 @@
+# Fitting of T1 and T2 relaxation curves, many curves at once
+
+# Imports
+import numpy as np  # Numpy for numerical operations
+
+from T1 import ToN
+from T1 import Values
+
+
+
+# Relaxation models, parameters are in the last axis of p
+def Exponential(t, p):
+    '''Inversion recovery M0*(1 - w*exp(-t/T1)), p = (M0, w, T1)'''
+    return p[..., 0:1]*(1 - p[..., 1:2]*np.exp(-t/p[..., 2:3]))
+
+
+def Stretched(t, p):
+    '''Stretched inversion recovery M0*(1 - w*exp(-(t/T1)**b)),
+        p = (M0, w, T1, b)'''
+    return p[..., 0:1]*(1 - p[..., 1:2]*np.exp(-(t/p[..., 2:3])**p[..., 3:4]))
+
+
+def NQR(t, p):
+    '''Magnetic relaxation of NQR spin 3/2, M0*(1 - w*exp(-3t/T1)),
+        p = (M0, w, T1)'''
+    return p[..., 0:1]*(1 - p[..., 1:2]*np.exp(-3*t/p[..., 2:3]))
+
+
+def Decay(t, p):
+    '''Echo decay M0*exp(-(2t/T2)**b), p = (M0, T2, b)
+        t is the pulse spacing tau, the echo forms at 2*tau'''
+    return p[..., 0:1]*np.exp(-(2*t/p[..., 1:2])**p[..., 2:3])
+
+
+# Global variables
+# Model function, parameter names and which of them are fitted as logarithm
+MODELS = {
+    'exp': (Exponential, ('M0', 'w', 'T1'), (2,)),
+    'stretched': (Stretched, ('M0', 'w', 'T1', 'b'), (2, 3)),
+    'nqr': (NQR, ('M0', 'w', 'T1'), (2,)),
+    'decay': (Decay, ('M0', 'T2', 'b'), (1, 2))
+}
+
+
+
+def Delays(d5_list):
+    '''Converts a delay list as made by Geometric_list
+        or Arithmetic_list into numpy array of seconds'''
+    return Values(d5_list)
+
+
+
+def Read_G(file_path):
+    '''Reads the delays from a -G.DAT file made by Legacy_G'''
+    with open(file_path) as f:
+        f.readline() # Column name
+        return np.array([float(line) for line in f if line.strip()])
+
+
+
+def Guess(t, y, model):
+    '''Rough starting parameters from the shape of each curve'''
+    names = MODELS[model][1]
+    # Sort by delay, keep unmeasured points (nan) at the end
+    order = np.argsort(np.where(np.isnan(y), np.inf, t), axis=-1)
+    t = np.take_along_axis(t, order, axis=-1)
+    y = np.take_along_axis(y, order, axis=-1)
+    last = np.sum(~np.isnan(y), axis=-1) - 1
+    rows = np.arange(len(y))
+
+    if model == 'decay':
+        m0 = y[:, 0]
+        tc = t[rows, last//2]
+    else:
+        m0 = y[rows, last]
+        tc = t[rows, last//2]
+    p = np.empty((len(y), len(names)))
+    for i, name in enumerate(names):
+        if name == 'M0': p[:, i] = m0
+        elif name == 'w': p[:, i] = np.clip(1 - y[:, 0]/m0, 0.1, 2)
+        elif name in ('T1', 'T2'): p[:, i] = tc
+        elif name == 'b': p[:, i] = 1
+    return p
+
+
+
+def Fit_curves(t, y, model='exp', p0=None, iterations=100):
+    '''Fits many relaxation curves in one batched least squares
+        t: delays in seconds, shape (N,) or (K, N)
+        y: amplitudes, shape (K, N), nan for missing points
+        p0: starting parameters (K, P), e.g. results of previous
+            temperature as warm start, guessed if None
+        returns parameters and their errors, both (K, P)'''
+    function, names, logs = MODELS[model]
+    y = np.atleast_2d(np.asarray(y, dtype=float))
+    t = np.broadcast_to(np.asarray(t, dtype=float), y.shape)
+    mask = ~np.isnan(y)
+    y0 = np.where(mask, y, 0)
+
+    if p0 is None:
+        p0 = Guess(t, y, model)
+    p0 = np.array(np.broadcast_to(p0, (len(y), len(names))), dtype=float)
+
+    # Fit time constants and exponents as logarithms to keep them positive
+    logs = list(logs)
+    def Params(q):
+        p = q.copy()
+        with np.errstate(over='ignore'):
+            p[:, logs] = np.exp(q[:, logs])
+        return p
+
+    def Residuals(q):
+        # Trial steps may overflow, such steps are rejected by their cost
+        with np.errstate(all='ignore'):
+            return np.where(mask, y0 - function(t, Params(q)), 0)
+
+    def Jacobian(q, r):
+        # Finite differences for all curves at once, shape (K, N, P)
+        J = np.empty(r.shape + (q.shape[1],))
+        for i in range(q.shape[1]):
+            step = 1e-6*np.maximum(np.abs(q[:, i]), 1e-3)
+            dq = q.copy()
+            dq[:, i] += step
+            J[..., i] = (r - Residuals(dq))/step[:, None]
+        return J
+
+    q = p0.copy()
+    q[:, logs] = np.log(np.abs(q[:, logs]))
+    r = Residuals(q)
+    cost = np.sum(r**2, axis=-1)
+    lam = np.full(len(y), 1e-3)
+    eye = np.eye(len(names))
+
+    # Levenberg-Marquardt steps, each curve has its own damping
+    for _ in range(iterations):
+        J = Jacobian(q, r)
+        A = np.einsum('knp,knq->kpq', J, J)
+        g = np.einsum('knp,kn->kp', J, r)
+        damped = A + lam[:, None, None]*(A*eye + 1e-12*eye)
+        step = np.linalg.solve(damped, g[..., None])[..., 0]
+
+        trial = q + step
+        r_trial = Residuals(trial)
+        cost_trial = np.sum(r_trial**2, axis=-1)
+        better = cost_trial < cost
+
+        q[better] = trial[better]
+        r[better] = r_trial[better]
+        change = np.where(better, cost - cost_trial, 0)
+        cost[better] = cost_trial[better]
+        lam = np.where(better, lam/3, lam*4)
+
+        # Stop when no curve improves any more
+        done = (better & (change <= 1e-9*cost)) | (lam > 1e10)
+        if np.all(done):
+            break
+
+    # Errors from the covariance of the fitted parameters
+    p = Params(q)
+    J = Jacobian(q, r)
+    A = np.einsum('knp,knq->kpq', J, J)
+    dof = np.maximum(mask.sum(axis=-1) - len(names), 1)
+    # Columns scaled to unit norm, large amplitudes would otherwise push
+    # the M0 direction below the pinv cutoff
+    scale = np.sqrt(np.diagonal(A, axis1=1, axis2=2))
+    scale = np.where(scale > 0, scale, 1)
+    outer = scale[:, :, None]*scale[:, None, :]
+    covariance = np.linalg.pinv(A/outer)/outer*(cost/dof)[:, None, None]
+    errors = np.sqrt(np.abs(np.diagonal(covariance, axis1=1, axis2=2)))
+    # Logarithmic parameters, error of exp(q) is p*dq
+    with np.errstate(invalid='ignore'):
+        errors[:, logs] *= p[:, logs]
+    return p, errors
+
+
+
+def Gradient(t, p, model):
+    '''Derivatives of the model by its parameters, shape (N, P)'''
+    function = MODELS[model][0]
+    t = np.asarray(t, dtype=float)
+    G = np.empty((len(t), len(p)))
+    for i in range(len(p)):
+        step = 1e-6*max(abs(p[i]), 1e-12)
+        dp = np.array(p, dtype=float)
+        dp[i] += step
+        G[:, i] = (function(t, dp) - function(t, p))/step
+    return G
+
+
+
+def Projection(data, reference):
+    '''Signed amplitude of data (R, I, R, I, ...) along the reference
+        signal, a matched filter that needs no phasing'''
+    data = np.asarray(data, dtype=float).view(complex)
+    reference = np.asarray(reference, dtype=float).view(complex)
+    return np.vdot(reference, data).real/np.linalg.norm(reference)
+
+
+
+class Online_fit():
+    '''Updates the T1 fit after every point of a sweep, chooses the most
+        informative next delay and decides when the result is precise enough'''
+
+    def __init__(self, model='exp', key='D5', target=0.05, min_points=6,
+            amplitude=None, iterations=10):
+        '''Initialization
+            key: params key of the swept delay
+            target: relative error of the time constant to stop at
+            amplitude: function(data, reference) giving the point amplitude,
+                projection on the first measured point if None'''
+        self.model = model
+        self.key = key
+        self.target = target
+        self.min_points = max(min_points, len(MODELS[model][1]) + 1)
+        self.amplitude = amplitude or Projection
+        self.iterations = iterations
+        # Index of the time constant among the parameters
+        self.index = 2 if model != 'decay' else 1
+
+        self.reference = None
+        self.t = list()
+        self.y = list()
+        self.p = None
+        self.errors = None
+        self.covariance = None
+
+
+    def Update(self, t, y):
+        '''Adds a point and updates the fit, starting from the last result'''
+        self.t.append(t)
+        self.y.append(y)
+        if len(self.t) < len(MODELS[self.model][1]) + 1: return
+
+        # Few steps from the previous estimate instead of a new fit
+        t, y = np.array(self.t), np.array(self.y)
+        if self.p is not None:
+            p, errors = Fit_curves(t, y, self.model, self.p, self.iterations)
+        # Start over if that left the measured range or is undetermined
+        if (self.p is None or not self.Sane(p[0])
+                or errors[0, self.index] > abs(p[0, self.index])/2):
+            p, errors = Fit_curves(t, y, self.model)
+        self.p, self.errors = p[0], errors[0]
+
+        # Covariance for choosing the next point
+        G = Gradient(t, self.p, self.model)
+        residuals = y - MODELS[self.model][0](t, self.p)
+        self.noise = np.sum(residuals**2)/max(len(t) - len(self.p), 1)
+        self.covariance = np.linalg.pinv(G.T @ G)*self.noise
+
+
+    def Sane(self, p):
+        '''Checks the time constant is within reach of measured delays'''
+        value = p[self.index]
+        return (np.isfinite(value) and min(self.t)/10 < value
+            and value < 10*max(self.t))
+
+
+    def Value(self):
+        '''Current time constant and its error'''
+        if self.p is None: return None, None
+        return self.p[self.index], self.errors[self.index]
+
+
+    def Done(self):
+        '''True once the time constant is known to the target precision'''
+        value, error = self.Value()
+        return (value is not None and len(self.t) >= self.min_points
+            and self.Sane(self.p) and 0 < error <= self.target*abs(value))
+
+
+    def Gain(self, delays):
+        '''Reduction of the time constant variance by measuring each delay'''
+        G = Gradient(delays, self.p, self.model)
+        CG = G @ self.covariance
+        return CG[:, self.index]**2/(np.sum(CG*G, axis=1) + self.noise)
+
+
+    def Next(self, points):
+        '''Index of the point to measure next, None to stop early'''
+        if self.Done():
+            value, error = self.Value()
+            print('Precise enough after', len(self.t), 'points:',
+                value, '+-', error)
+            return None
+        if len(self.t) < self.min_points or not self.Sane(self.p):
+            # Not enough points for a reliable fit, keep planned order
+            return 0
+        delays = [ToN(point[self.key]) for point in points]
+        return int(np.argmax(self.Gain(delays)))
+
+
+    def Add(self, point, data):
+        '''Adds a measured point of the sweep'''
+        if self.reference is None:
+            self.reference = data
+        self.Update(ToN(point[self.key]), self.amplitude(data, self.reference))
+
+
+
+if __name__ == "__main__":
+    # Fit many noisy curves at once, then again with warm starts
+    import time
+
+    from T1 import Geometric_list
+
+    t = Delays(Geometric_list('10u', '1s', 20, shuffle=False))
+    curves = 300
+    T1 = np.geomspace(1e-3, 1e-1, curves)
+    true = np.stack([np.full(curves, 100.), np.full(curves, 1.9), T1], axis=1)
+    y = Exponential(t, true) + np.random.normal(0, 1, (curves, len(t)))
+
+    start = time.time()
+    p, errors = Fit_curves(t, y)
+    print('{} curves in {:.3f} s, median relative T1 error {:.3g}'.format(
+        curves, time.time() - start, np.median(np.abs(p[:, 2]/T1 - 1))))
+
+    start = time.time()
+    p, errors = Fit_curves(t, y, p0=p*1.05)
+    print('Warm start {:.3f} s'.format(time.time() - start))
+
+    # Relative errors must not depend on the amplitude scale
+    fitted, relative = p, errors/p
+    for scale in (1e4, 1e8, 1e10):
+        p, errors = Fit_curves(t, y*scale, p0=fitted*[scale, 1, 1])
+        assert np.allclose(errors/p, relative, rtol=1e-3)
+    print('Errors independent of the amplitude scale')
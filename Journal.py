@@ -0,0 +1,108 @@
+# Persistent record of planned series and measured points, so an
+# interrupted sweep resumes at the first unfinished point
+
+# Imports
+import json
+import sqlite3
+import threading
+import time
+
+# Global variables
+JOURNAL_FILE = 'journal.sqlite'
+
+
+
+class Job_store():
+    '''SQLite journal of measurement series and their finished points'''
+
+    def __init__(self, file_path=JOURNAL_FILE):
+        '''Opens or creates the journal file'''
+        self.file_path = file_path
+        # Points are recorded from the background writer thread
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(file_path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('''CREATE TABLE IF NOT EXISTS series (
+                name TEXT PRIMARY KEY,
+                kind TEXT,
+                params TEXT,
+                points TEXT,
+                created REAL,
+                finished REAL)''')
+            self.db.execute('''CREATE TABLE IF NOT EXISTS points (
+                series TEXT,
+                file_name TEXT,
+                date TEXT,
+                start TEXT,
+                finish TEXT,
+                saved REAL,
+                PRIMARY KEY (series, file_name))''')
+
+
+    def Plan(self, name, kind, params, points):
+        '''Records a planned series, or finds the unfinished one with
+            the same name. Returns the planned points still to measure'''
+        with self.lock, self.db:
+            row = self.db.execute(
+                'SELECT points, finished FROM series WHERE name = ?',
+                (name,)).fetchone()
+            if row is None or row[1] is not None:
+                # New series, or repeating a finished one
+                self.db.execute('DELETE FROM points WHERE series = ?',
+                    (name,))
+                self.db.execute('INSERT OR REPLACE INTO series VALUES '
+                    '(?, ?, ?, ?, ?, NULL)', (name, kind, json.dumps(params),
+                    json.dumps(points), time.time()))
+                return points
+
+            # Resume with the originally planned points
+            points = json.loads(row[0])
+            done = {file_name for (file_name,) in self.db.execute(
+                'SELECT file_name FROM points WHERE series = ?', (name,))}
+
+        pending = [point for point in points if point['file_name'] not in done]
+        print('Resuming', name, 'at point', len(points) - len(pending) + 1,
+            'of', len(points))
+        return pending
+
+
+    def Measured(self, name):
+        '''Planned points of series name recorded as finished'''
+        with self.lock:
+            row = self.db.execute('SELECT points FROM series WHERE name = ?',
+                (name,)).fetchone()
+            done = {file_name for (file_name,) in self.db.execute(
+                'SELECT file_name FROM points WHERE series = ?', (name,))}
+        if row is None:
+            return list()
+        return [point for point in json.loads(row[0])
+            if point['file_name'] in done]
+
+
+    def Done(self, name, params):
+        '''Records the point in params as finished, with its timestamps'''
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO points VALUES '
+                '(?, ?, ?, ?, ?, ?)', (name, params['file_name'],
+                params.get('DATESTA'), params.get('TIMESTA'),
+                params.get('TIMEEND'), time.time()))
+
+
+    def Finish(self, name):
+        '''Marks the whole series as finished'''
+        with self.lock, self.db:
+            self.db.execute('UPDATE series SET finished = ? WHERE name = ?',
+                (time.time(), name))
+
+
+    def Unfinished(self):
+        '''Names of series that were planned but not finished'''
+        with self.lock:
+            return [name for (name,) in self.db.execute(
+                'SELECT name FROM series WHERE finished IS NULL')]
+
+
+    def Close(self):
+        '''Closes the journal file'''
+        with self.lock:
+            self.db.close()
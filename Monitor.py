@@ -0,0 +1,141 @@
+# Signal to noise of the partially averaged data during long
+# acquisitions, stops averaging once the target is reached
+
+# Imports
+import time
+
+import numpy as np  # Numpy for numerical operations
+
+# Global variables
+INTERVAL = 10   # Seconds between reads of the partial data
+TAIL = 0.25     # Fraction of points at the end of the FID holding only noise
+WIDTH = 32      # Points around the echo top summed for the signal
+
+
+
+class Running_stats():
+    '''Mean and variance updated one value at a time (Welford)'''
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+
+    def Add(self, value):
+        '''Adds a value'''
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(value - self.mean)
+
+
+    def Variance(self):
+        '''Sample variance of the values so far'''
+        return self.m2/(self.count - 1) if self.count > 1 else 0.
+
+
+
+def Signal_noise(data, tail=TAIL, width=WIDTH):
+    '''Signal and noise of data (R, I, R, I, ...)
+        signal: magnitude of the sum of width points around the echo top
+        noise: standard deviation of that sum, from the end of the FID'''
+    x = np.asarray(data, dtype=float).view(complex)
+    end = x[-max(int(len(x)*tail), 2):]
+    # Noise of the real and imaginary part of a single point
+    sigma = np.sqrt(np.mean(np.abs(end - end.mean())**2)/2)
+
+    top = int(np.argmax(np.abs(x[:len(x) - len(end)])))
+    low = max(top - width//2, 0)
+    window = x[low:low + width]
+    return np.abs(window.sum()), sigma*np.sqrt(len(window))
+
+
+
+class Snr_monitor():
+    '''Check for the Acquisition_waiter reading the partially averaged
+        data, stops the acquisition once the target SNR is reached'''
+
+    def __init__(self, target=None, interval=INTERVAL, min_scans=4,
+            tail=TAIL, width=WIDTH):
+        '''Initialization
+            target: SNR at which averaging stops, None only reports
+            interval: seconds between reads of the data
+            min_scans: scans before the first estimate'''
+        self.target = target
+        self.interval = interval
+        self.min_scans = min_scans
+        self.tail = tail
+        self.width = width
+        self.app = None
+        self.doc = None
+
+
+    def Start(self, app, doc):
+        '''Starts following the acquisition of doc'''
+        self.app = app
+        self.doc = doc
+        self.last = time.time()
+        self.scans = 0
+        self.snr = 0.
+        self.stopped = False
+        # SNR of a single scan, averaged over the reads
+        self.single = Running_stats()
+
+
+    def Check(self):
+        '''True when the acquisition is finished or was stopped'''
+        if self.app.CheckAcquisition:
+            return True
+        if time.time() - self.last < self.interval:
+            return False
+        self.last = time.time()
+
+        # Only read data when new scans were added
+        scans = int(self.doc.GetNMRParameter('Actual Scans 1D') or 0)
+        if scans < self.min_scans or scans == self.scans:
+            return False
+        signal, noise = Signal_noise(self.doc.GetData, self.tail, self.width)
+        self.scans = scans
+        self.snr = signal/noise if noise > 0 else np.inf
+        # Signal grows with scans, noise with their square root
+        self.single.Add(self.snr/np.sqrt(scans))
+        print('Scans: {}, SNR: {:.1f}'.format(scans, self.snr))
+
+        if self.target is not None and self.snr >= self.target:
+            print('Target SNR reached after', scans, 'scans, stopping')
+            self.app.Abort
+            self.stopped = True
+            return True
+        return False
+
+
+    def Predicted_scans(self):
+        '''Scans needed for the target SNR from the reads so far'''
+        if self.target is None or self.single.mean <= 0:
+            return None
+        return int(np.ceil((self.target/self.single.mean)**2))
+
+
+
+if __name__ == "__main__":
+    # Long FID on the simulated TNMR stopped at the target SNR
+    import os
+    import tempfile
+
+    import Simulation
+    from TNMR_legacy import Tecmag
+
+    Simulation.Configure(noise=2000)
+    A = Tecmag(simulate=True)
+    A.Test_params()
+    A.params['file_path'] = tempfile.mkdtemp() + os.sep
+    A.params.update({'NS': '1024', 'D9': '10m', 'file_name': 'FID-snr'})
+    A.waiter.poll_slow = 0.2
+
+    A.snr_monitor = Snr_monitor(target=50, interval=0.5)
+    start = time.time()
+    A.Get_FID(A.params)
+    print('Stopped after {:.1f} s, {} of 1024 scans, predicted {}'.format(
+        time.time() - start, A.params['NSacq'],
+        A.snr_monitor.Predicted_scans()))
@@ -2,8 +2,10 @@
 
 # Imports
 import os
+import numpy as np  # Numpy for numerical operations
 
 from T1 import ToN
+from T1 import Values
 
 
 
@@ -14,6 +16,7 @@ def Legacy_export(data, params):
 
     print('Writing to file: ', os.path.join(file_path, file_name))
 
+    params = Export_params(params)
     L = Legacy_params()
 
     # Open writeable file
@@ -35,18 +38,38 @@ def Legacy_export(data, params):
         f.write('[PPFILE]\n')
 
         f.write('[DATA]\n')
-        for i in range(int(params['TD'])):
-            # Add space for positive numbers
-            # Normalize by number of scans
-            f.write(' '.join([
-                '{: f}'.format(data[2*i]/int(params['NS'])),
-                '{: f}'.format(data[2*i+1]/int(params['NS']))
-                ]) + '\n')
+        f.write(Legacy_data(data, params))
 
     print('File writing complete')
 
 
 
+def Acquired_scans(params):
+    '''Scans summed in the data, NSacq once measured, else NS'''
+    return int(params.get('NSacq') or params['NS'])
+
+
+
+def Export_params(params):
+    '''Copy of params as exported, NS is the number of scans acquired,
+        which is lower than planned for points stopped early'''
+    return dict(params, NS=str(Acquired_scans(params)))
+
+
+
+def Legacy_data(data, params):
+    '''Formats the [DATA] block, one line of real and imaginary part
+        per point, normalized by number of scans'''
+    points = int(params['TD'])
+
+    # data format: (R, I, R, I, ...), normalize all at once
+    values = np.asarray(data, dtype=float)[:2*points] / Acquired_scans(params)
+
+    # Add space for positive numbers, format all lines in one call
+    return ('% f % f\n'*points) % tuple(values.tolist())
+
+
+
 def Legacy_G(d5_list, params):
     '''Generates a .G file. ADD columns later!'''
     file_path = params['file_path'] + 'export\\'
@@ -55,8 +78,8 @@ def Legacy_G(d5_list, params):
     with open(os.path.join(file_path, file_name),'w') as f:
         f.write('D5\n')
 
-        for d5 in d5_list.split(' '):
-            f.write('{: E}'.format(ToN(d5)) + '\n')
+        for d5 in Values(d5_list).tolist():
+            f.write('{: E}'.format(d5) + '\n')
 
 
 
@@ -140,3 +163,32 @@ class Legacy_params():
         }
 
 
+
+
+
+if __name__ == "__main__":
+    # Compare with line by line formatting and time it
+    import time
+
+    params = {'NS': '256'}
+    for td in [2048, 16384]:
+        params['TD'] = str(td)
+        data = tuple(np.random.normal(0, 1e6, 2*td))
+
+        start = time.time()
+        lines = list()
+        for i in range(int(params['TD'])):
+            lines.append(' '.join([
+                '{: f}'.format(data[2*i]/int(params['NS'])),
+                '{: f}'.format(data[2*i+1]/int(params['NS']))
+                ]) + '\n')
+        lines = ''.join(lines)
+        loop = time.time() - start
+
+        start = time.time()
+        block = Legacy_data(data, params)
+        bulk = time.time() - start
+
+        assert block == lines, 'Legacy_data differs at TD {}'.format(td)
+        print('TD {}: identical, loop {:.2f} ms, bulk {:.2f} ms'.format(
+            td, 1000*loop, 1000*bulk))
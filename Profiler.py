@@ -0,0 +1,201 @@
+# Recording of COM calls to TNMR, their latency and payload,
+# per method and per sweep point
+
+# Imports
+import json
+import time
+import bisect
+
+# Global variables
+PROFILE_FILE = 'com_profile.log'
+# Upper edges of the latency histogram bins in seconds, last bin is open
+BINS = (0.00001, 0.0001, 0.001, 0.01, 0.1, 1, 10)
+
+
+
+def Payload(value):
+    '''Approximate size in bytes of a COM argument or result'''
+    if type(value) == str:
+        return len(value)
+    if type(value) in (tuple, list):
+        return sum(Payload(item) for item in value) if (value and
+            type(value[0]) == str) else 8*len(value)
+    if type(value) in (int, float, bool):
+        return 8
+    return getattr(value, 'nbytes', 0)
+
+
+
+class Method_stats():
+    '''Count, latency histogram and payload of one COM method'''
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.bytes = 0
+        self.histogram = [0]*(len(BINS) + 1)
+
+
+    def Add(self, seconds, size):
+        '''Records a single call'''
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.bytes += size
+        self.histogram[bisect.bisect_left(BINS, seconds)] += 1
+
+
+    def Summary(self):
+        '''Dictionary for printing and logging'''
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total/self.count if self.count else 0,
+            'max': self.max,
+            'bytes': self.bytes,
+            'histogram': self.histogram
+        }
+
+
+
+class Com_stats():
+    '''Collects COM calls of a sweep, streams them per point to a log'''
+
+    def __init__(self, log_file=PROFILE_FILE):
+        '''Initialization, log_file: JSON lines appended, None to not log'''
+        self.log = open(log_file, 'a') if log_file else None
+        self.series = None
+        self.point = None
+        # Method_stats of the whole sweep and of each point
+        self.methods = dict()
+        self.points = dict()
+
+
+    def Wrap(self, create):
+        '''Function like CreateObject returning recorded COM objects'''
+        def Create(progid):
+            return Com_proxy(create(progid), self)
+        return Create
+
+
+    def Record(self, method, seconds, size):
+        '''Adds a call to the sweep and the current point'''
+        point = self.points.setdefault(self.point, dict())
+        for methods in (self.methods, point):
+            if method not in methods:
+                methods[method] = Method_stats()
+            methods[method].Add(seconds, size)
+
+
+    def Start(self, series):
+        '''Starts recording a new sweep'''
+        self.series = series
+        self.point = None
+        self.methods = dict()
+        self.points = dict()
+
+
+    def Point(self, point):
+        '''Following calls belong to point, logs the previous one'''
+        self.Write(self.point)
+        self.point = point
+
+
+    def Summary(self, methods=None):
+        '''Method summaries of the sweep or of given methods'''
+        if methods is None:
+            methods = self.methods
+        return {name: stats.Summary() for name, stats in methods.items()}
+
+
+    def Write(self, point):
+        '''Streams the calls of point to the log'''
+        if self.log is None or point not in self.points:
+            return
+        self.log.write(json.dumps({'series': self.series, 'point': point,
+            'time': time.time(), 'methods': self.Summary(self.points[point])})
+            + '\n')
+        self.log.flush()
+
+
+    def Report(self):
+        '''Prints and logs the summary of the sweep'''
+        self.Write(self.point)
+        self.point = None
+
+        summary = self.Summary()
+        print('COM calls of', self.series)
+        print('{:<20}{:>8}{:>12}{:>12}{:>12}{:>12}'.format('Method', 'calls',
+            'total [ms]', 'mean [ms]', 'max [ms]', 'bytes'))
+        for name, stats in sorted(summary.items(),
+                key=lambda item: -item[1]['total']):
+            print('{:<20}{:>8}{:>12.2f}{:>12.3f}{:>12.3f}{:>12}'.format(name,
+                stats['count'], 1000*stats['total'], 1000*stats['mean'],
+                1000*stats['max'], stats['bytes']))
+
+        if self.log is not None:
+            self.log.write(json.dumps({'series': self.series, 'point': None,
+                'time': time.time(), 'methods': summary}) + '\n')
+            self.log.flush()
+        return summary
+
+
+    def Close(self):
+        '''Closes the log file'''
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+
+
+class Com_proxy():
+    '''Transparent wrapper of a COM object, records the time and
+        payload of every method call and property read'''
+
+    def __init__(self, target, stats):
+        self.target = target
+        self.stats = stats
+
+
+    def __getattr__(self, name):
+        '''Only called for attributes of the wrapped object'''
+        start = time.perf_counter()
+        value = getattr(self.target, name)
+        if callable(value):
+            return self.Timed(name, value)
+        # Properties like GetData are evaluated on access
+        self.stats.Record(name, time.perf_counter() - start, Payload(value))
+        return value
+
+
+    def Timed(self, name, method):
+        '''Method recording its calls'''
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            self.stats.Record(name, time.perf_counter() - start,
+                Payload(args) + Payload(list(kwargs.values()))
+                + Payload(result))
+            return result
+        return call
+
+
+
+if __name__ == "__main__":
+    # Overhead of the proxy on simulated TNMR
+    import Simulation
+
+    stats = Com_stats(None)
+    doc = Simulation.CreateObject('NTNMR.Document')
+    proxy = stats.Wrap(Simulation.CreateObject)('NTNMR.Document')
+    for name, target in [('direct', doc), ('proxy', proxy)]:
+        start = time.perf_counter()
+        for i in range(100000):
+            target.SetNMRParameter('Scans 1D', '16')
+        print('{}: {:.2f} us per call'.format(name,
+            10*(time.perf_counter() - start)))
+    stats.Start('overhead')
+    stats.Point('only')
+    proxy.GetData
+    stats.Report()
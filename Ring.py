@@ -0,0 +1,197 @@
+# Ring buffer of FIDs in shared memory, the acquisition writes each
+# point once and any number of readers get views without copying
+
+# Imports
+import time
+import multiprocessing
+
+import numpy as np  # Numpy for numerical operations
+
+# Global variables
+SLOTS = 16      # FIDs kept in the ring
+LABEL = 64      # Bytes of the file name stored with each FID
+POLL = 0.001    # Interval in seconds readers check for new FIDs
+
+
+
+class Overrun(Exception):
+    '''FID was overwritten before the reader was done with it'''
+
+
+
+class Ring_buffer():
+    '''Fixed number of complex FID slots of TD points in shared memory
+        The writer never waits, it overwrites the oldest FID. Every FID
+        gets a sequence number, a slot holding FID seq is marked -1
+        while being written, so readers can check their view is intact'''
+
+    def __init__(self, td, slots=SLOTS):
+        '''Initialization, td: largest number of complex points of a FID'''
+        self.td = td
+        self.slots = slots
+        # Works with Python 3.7, passed to processes at their start
+        self.data = multiprocessing.RawArray('d', slots*2*td)
+        # Next sequence number, then sequence number and points per slot
+        self.header = multiprocessing.RawArray('q', 1 + 2*slots)
+        self.labels = multiprocessing.RawArray('c', slots*LABEL)
+        self.Views()
+        self.meta[:, 0] = -1
+
+
+    def Views(self):
+        '''Numpy views of the shared arrays'''
+        self.floats = np.frombuffer(self.data, dtype=float).reshape(
+            self.slots, 2*self.td)
+        self.fids = self.floats.view(complex)
+        header = np.frombuffer(self.header, dtype=np.int64)
+        self.head = header[:1]
+        self.meta = header[1:].reshape(self.slots, 2)
+
+
+    def __getstate__(self):
+        '''Only the shared arrays go to other processes'''
+        return {'td': self.td, 'slots': self.slots, 'data': self.data,
+            'header': self.header, 'labels': self.labels}
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.Views()
+
+
+    def Write(self, data, label=''):
+        '''Copies FID (R, I, R, I, ...) into the oldest slot, returns its
+            sequence number, None if it is larger than the slots'''
+        data = np.asarray(data, dtype=float)
+        if len(data) > 2*self.td:
+            print('FID of', len(data)//2, 'points does not fit the ring')
+            return None
+
+        seq = int(self.head[0])
+        slot = seq % self.slots
+        self.meta[slot, 0] = -1
+        self.floats[slot, :len(data)] = data
+        self.labels[slot*LABEL:(slot + 1)*LABEL] = label.encode()[
+            :LABEL].ljust(LABEL, b'\0')
+        self.meta[slot, 1] = len(data)//2
+        self.meta[slot, 0] = seq
+        self.head[0] = seq + 1
+        return seq
+
+
+    def Head(self):
+        '''Sequence number the next FID will get'''
+        return int(self.head[0])
+
+
+    def Oldest(self):
+        '''Sequence number of the oldest FID still in the ring'''
+        return max(self.Head() - self.slots, 0)
+
+
+    def Valid(self, seq):
+        '''True if FID seq is in its slot and not being overwritten'''
+        return int(self.meta[seq % self.slots, 0]) == seq
+
+
+    def View(self, seq):
+        '''Complex view of FID seq without copying, check Valid(seq)
+            after using it'''
+        if not self.Valid(seq):
+            raise Overrun('FID {} is no longer in the ring'.format(seq))
+        slot = seq % self.slots
+        return self.fids[slot, :self.meta[slot, 1]]
+
+
+    def Label(self, seq):
+        '''File name written with FID seq'''
+        slot = seq % self.slots
+        return bytes(self.labels[slot*LABEL:(slot + 1)*LABEL]).rstrip(
+            b'\0').decode()
+
+
+    def Copy(self, seq):
+        '''Copy of FID seq, raises Overrun if it changed while copying'''
+        fid = self.View(seq).copy()
+        if not self.Valid(seq):
+            raise Overrun('FID {} was overwritten while copying'.format(seq))
+        return fid
+
+
+
+class Ring_reader():
+    '''Reads FIDs of a Ring_buffer in order. A reader that falls more than
+        the ring size behind skips to the oldest FID and counts the lost'''
+
+    def __init__(self, ring, start=None):
+        '''Initialization, start: first sequence number to read,
+            the next written FID if None'''
+        self.ring = ring
+        self.position = ring.Head() if start is None else start
+        self.lost = 0
+
+
+    def Next(self, timeout=None):
+        '''Waits for the next FID, returns its sequence number and view,
+            None if nothing arrived within timeout'''
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            while self.ring.Head() <= self.position:
+                if end is not None and time.time() >= end:
+                    return None
+                time.sleep(POLL)
+
+            # Overwritten FIDs are skipped
+            oldest = self.ring.Oldest()
+            if self.position < oldest:
+                self.lost += oldest - self.position
+                self.position = oldest
+
+            seq = self.position
+            self.position += 1
+            try:
+                return seq, self.ring.View(seq)
+            except Overrun:
+                # Writer overtook between the checks, try the next one
+                self.lost += 1
+
+
+
+def Reader_process(ring, count, delay):
+    '''Slow reader for the demo, processes count FIDs'''
+    reader = Ring_reader(ring, start=0)
+    read, intact = 0, 0
+    while reader.position < count:
+        result = reader.Next(timeout=1)
+        if result is None: break
+        seq, fid = result
+        np.abs(np.fft.fft(fid)).max()
+        time.sleep(delay)
+        read += 1
+        # Slot may have been reused while processing
+        intact += ring.Valid(seq)
+    print('Reader: {} read, {} still intact after processing, {} lost'.format(
+        read, intact, reader.lost))
+
+
+
+if __name__ == "__main__":
+    # Fast writer with a reader process that cannot keep up
+    td = 16384
+    ring = Ring_buffer(td, slots=8)
+    count = 200
+    reader = multiprocessing.Process(target=Reader_process,
+        args=(ring, count, 0.004))
+    reader.start()
+
+    data = tuple(np.random.normal(0, 1, 2*td).tolist())
+    writing = 0
+    for i in range(count):
+        start = time.time()
+        ring.Write(data, 'point-{:03}'.format(i))
+        writing += time.time() - start
+        time.sleep(0.002)
+    print('Writer: {} FIDs of {} points, {:.0f} us per write'.format(count,
+        td, 1000000*writing/count))
+    print('Last label:', ring.Label(ring.Head() - 1))
+    reader.join()
@@ -0,0 +1,172 @@
+# Expected duration of measurements and ordering of queued jobs
+
+# Imports
+import time
+
+from T1 import Geometric_list
+from T1 import Arithmetic_list
+from T1 import ToN
+from Acquisition import Estimate_time
+from NMR7 import Legacy_export
+from Design import Optimal_list
+
+
+
+def Scan_settings(params, pulses):
+    '''TNMR parameters of a single scan from params'''
+    settings = {
+        'Scans 1D': params['NS'],
+        'Last Delay': params['D9'],
+        'pre': params['pre'],
+        'rd': params['rd'],
+        'tau': params['TAU'],
+        'ad': params['ad'],
+        'Acq. Points': params['TD'],
+        'Dwell Time': params['DW']
+    }
+    # Pulse lengths d1, d2, ...
+    for i in range(pulses):
+        settings['d{}'.format(i + 1)] = params['d123']
+    return settings
+
+
+
+def Job_time(kind, params):
+    '''Expected duration in seconds of a FID, INV, T1 or T2 job'''
+    if kind == 'FID':
+        return Estimate_time(Scan_settings(params, 2))
+
+    elif kind == 'INV':
+        settings = Scan_settings(params, 3)
+        settings['d5'] = params['D5meas']
+        return Estimate_time(settings)
+
+    elif kind == 'T1':
+        if params.get('T1prior'):
+            d5_list = Optimal_list(params, params['T1prior'],
+                ToN(params.get('T1prec', '0.05')))
+        else:
+            d5_list = Geometric_list(params['D5min'],
+                params['D5max'], params['D5N'], shuffle=True)
+        table = d5_list.Measured() - ToN(params['pre'])
+        return Estimate_time(Scan_settings(params, 3), {'d5': table})
+
+    elif kind == 'T2':
+        tau_list = Arithmetic_list(params['dTAU'], params['TAUN'],
+            start=params['TAUmin'], shuffle=True)
+        taus = tau_list.Measured()
+        ads = taus - ToN(params['TAUmin']) + ToN(params['adT2'])
+        return Estimate_time(Scan_settings(params, 2),
+            {'tau': taus, 'ad': ads})
+
+    else:
+        raise ValueError('Unknown measurement type: ' + kind)
+
+
+
+class Job():
+    '''Queued measurement with its own params and optional deadline'''
+
+    def __init__(self, kind, params, deadline=None):
+        '''Initialization
+            kind: FID, INV, T1 or T2
+            deadline: time.time() by which the job has to finish'''
+        self.kind = kind
+        self.params = params
+        self.name = params.get('file_name')
+        self.deadline = deadline
+        self.predicted = Job_time(kind, params)
+        self.actual = None
+
+
+    def __repr__(self):
+        return '{} {}'.format(self.kind, self.name)
+
+
+
+def Order(jobs, start=None, strict=False):
+    '''Orders jobs so deadlines are met and the instrument stays busy
+        Jobs with deadlines go earliest deadline first, the rest
+        shortest first after them. Jobs that would miss their deadline
+        go last, or are left out if strict. Returns ordered and late jobs'''
+    if start is None:
+        start = time.time()
+
+    timed = sorted([job for job in jobs if job.deadline is not None],
+        key=lambda job: job.deadline)
+    free = sorted([job for job in jobs if job.deadline is None],
+        key=lambda job: job.predicted)
+
+    # Keep deadline jobs that still fit after the ones before them
+    order, late = list(), list()
+    finish = start
+    for job in timed:
+        if finish + job.predicted <= job.deadline:
+            order.append(job)
+            finish += job.predicted
+        else:
+            late.append(job)
+
+    order += free
+    if not strict:
+        order += late
+    return order, late
+
+
+
+def Run(tecmag, jobs, start=None, strict=False):
+    '''Runs the jobs on Tecmag in scheduled order and
+        reports predicted and actual durations'''
+    order, late = Order(jobs, start, strict)
+    for job in late:
+        print('Cannot finish before deadline:', job)
+
+    for job in order:
+        print('Running', job)
+        begin = time.time()
+        if job.kind == 'FID':
+            Legacy_export(tecmag.Get_FID(job.params), job.params)
+        elif job.kind == 'INV':
+            Legacy_export(tecmag.Get_INV(job.params), job.params)
+        elif job.kind == 'T1':
+            tecmag.Get_T1(job.params)
+        elif job.kind == 'T2':
+            tecmag.Get_T2(job.params)
+        job.actual = time.time() - begin
+
+    Report(order)
+    return order
+
+
+
+def Report(jobs):
+    '''Prints predicted and actual duration of each job'''
+    print('Job\tpredicted [s]\tactual [s]')
+    for job in jobs:
+        actual = '{:.1f}'.format(job.actual) if job.actual else '-'
+        print('{}\t{:.1f}\t{}'.format(job, job.predicted, actual))
+
+
+
+if __name__ == "__main__":
+    # Schedule a short night on the simulated spectrometer
+    import os
+    import tempfile
+
+    from TNMR_legacy import Tecmag
+
+    A = Tecmag(simulate=True)
+    A.Test_params()
+    A.params['file_path'] = tempfile.mkdtemp() + os.sep
+    os.mkdir(A.params['file_path'] + 'export\\')
+    A.params.update({'NS': '1', 'D9': '20m', 'D5min': '10u', 'D5max': '10m',
+        'D5N': '8', 'TAUN': '8'})
+
+    jobs = list()
+    for kind, deadline in [('T2', None), ('T1', time.time() + 2),
+            ('FID', time.time() + 0.5)]:
+        params = dict(A.params)
+        params['file_name'] = kind + '-' + params['file_key']
+        jobs.append(Job(kind, params, deadline))
+
+    Run(A, jobs)
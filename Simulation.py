@@ -0,0 +1,464 @@
+# Simulated TNMR application for running the control code without
+# the spectrometer, mimics comtypes.client access to NTNMR objects
+
+# Imports
+import os   # For sequence file names
+import time
+import functools
+import collections
+
+import numpy as np  # Numpy for numerical operations
+
+from Units import ToN
+from Acquisition import Estimate_time
+from Acquisition import Get_time
+
+# Global variables
+APP = None  # Running simulated TNMR application
+
+# Tables defined in the simulated pulse sequences
+SEQUENCE_TABLES = {
+    'T1.tps': ['d5'],
+    'T2.tps': ['dtau'],
+    'three_pulse.tps': ['d5'],
+    'two_pulse.tps': ['tau', 'ad']
+}
+# Sequences with an inversion pulse before the echo
+INVERSION = ('T1.tps', 'three_pulse.tps')
+
+# Simulated spectrometer and sample, change with Configure
+SETTINGS = {
+    'latency': 0,           # Seconds added to every COM call
+    'time_scale': 1,        # Acquisition time relative to Estimate_time
+    'acq_time': None,       # Fixed acquisition time in seconds if set
+    'T1': 0.01,             # Spin-lattice relaxation time in seconds
+    'T2': 0.001,            # Echo decays as exp(-2*tau/T2)
+    'T2star': 0.00002,      # Decay of the echo shape in seconds
+    'offset': 10000,        # Frequency offset of the line in Hz
+    'amplitude': 1000,      # Echo amplitude of a single scan
+    'noise': 50,            # Noise of a single scan and point
+    'seed': 0               # Seed of the noise generator
+}
+
+# Number of calls to each simulated COM method
+CALLS = collections.Counter()
+RNG = np.random.default_rng(SETTINGS['seed'])
+
+
+
+def Configure(**settings):
+    '''Changes SETTINGS of the simulation and restarts the noise'''
+    global RNG
+    for key in settings:
+        if key not in SETTINGS:
+            raise ValueError('Unknown simulation setting: ' + key)
+    SETTINGS.update(settings)
+    RNG = np.random.default_rng(SETTINGS['seed'])
+
+
+
+def Reset_calls():
+    '''Returns the COM call counts so far and starts counting again'''
+    calls = dict(CALLS)
+    CALLS.clear()
+    return calls
+
+
+
+def Com_call(method):
+    '''Counts calls of a simulated COM method and adds the latency'''
+    @functools.wraps(method)
+    def call(*args, **kwargs):
+        CALLS[method.__name__] += 1
+        if SETTINGS['latency']:
+            time.sleep(SETTINGS['latency'])
+        return method(*args, **kwargs)
+    return call
+
+
+
+def CreateObject(progid):
+    '''Replacement for comtypes.client.CreateObject'''
+    global APP
+    if progid == 'NTNMR.Application':
+        # TNMR starts with an empty document open
+        APP = Sim_application()
+        APP.New_document()
+        return APP
+    elif progid == 'NTNMR.Document':
+        # Documents open in the running application
+        if APP is None:
+            APP = Sim_application()
+        return APP.New_document()
+    else:
+        raise OSError('Cannot simulate ' + progid)
+
+
+
+def GetActiveObject(progid):
+    '''Replacement for comtypes.client.GetActiveObject'''
+    if progid == 'NTNMR.Application' and APP is not None:
+        return APP
+    raise OSError('No running ' + progid)
+
+
+
+class Sim_application():
+    '''Simulated NTNMR.Application'''
+
+    def __init__(self):
+        self.documents = list()
+        self.active = None
+        # [start, stop] times of every acquisition
+        self.acquisitions = list()
+
+
+    def New_document(self):
+        '''Opens a new document and makes it active'''
+        self.active = Sim_document(self)
+        self.documents.append(self.active)
+        return self.active
+
+
+    @property
+    @Com_call
+    def CheckAcquisition(self):
+        '''True when the active document is not acquiring'''
+        if self.active is None: return True
+        return self.active.Finished()
+
+
+    @property
+    @Com_call
+    def Abort(self):
+        '''Stops acquisition in active document'''
+        if self.active is not None:
+            self.active.Stop()
+        return True
+
+
+    @property
+    @Com_call
+    def CloseActiveFile(self):
+        '''Closes active document'''
+        if self.active is None: return False
+        self.documents.remove(self.active)
+        self.active = self.documents[-1] if self.documents else None
+        return True
+
+
+    @Com_call
+    def CloseFile(self, path):
+        '''Closes document by path, empty path closes the active one'''
+        if path:
+            for doc in self.documents:
+                if doc.path == path:
+                    break
+            else:
+                return False
+            self.active = doc
+        return self.CloseActiveFile
+
+
+    @property
+    @Com_call
+    def GetDocumentList(self):
+        '''Comma separated paths of open documents'''
+        return ','.join(doc.path for doc in self.documents)
+
+
+
+class Sim_document():
+    '''Simulated NTNMR.Document, acquires echoes of a sample
+        with the T1 and T2 in SETTINGS'''
+
+    def __init__(self, app):
+        self.app = app
+        self.path = ''
+        self.sequence = ''
+        self.params = dict()
+        self.tables = dict()
+        # Acquisition timing, row_times: duration of each 2D row
+        self.start = None
+        self.stop = None
+        self.acq_time = 0
+        self.row_times = np.zeros(0)
+        self.interval = None
+        self.aborted = False
+        # Data generated for the scans done so far
+        self.data = None
+        self.data_scans = None
+
+
+    @Com_call
+    def LoadSequence(self, path):
+        '''Loads pulse program, tables start empty'''
+        self.sequence = path
+        self.tables = dict()
+        return True
+
+
+    @Com_call
+    def SetNMRParameter(self, key, value):
+        '''Sets parameter in the document'''
+        self.params[key] = value
+        return True
+
+
+    @Com_call
+    def GetNMRParameter(self, key):
+        '''Reads parameter from the document, scans are counted live'''
+        if key == 'Actual Scans 1D' and self.start is not None:
+            return str(self.Current_scans())
+        return self.params.get(key, '')
+
+
+    @property
+    @Com_call
+    def GetTableList(self):
+        '''Comma separated tables of the loaded sequence'''
+        return ','.join(SEQUENCE_TABLES.get(self.Sequence_name(), []))
+
+
+    @Com_call
+    def SetTable(self, key, value):
+        '''Sets a table of swept values'''
+        self.tables[key] = value
+        return True
+
+
+    @Com_call
+    def GetTable(self, key):
+        '''Reads a table of swept values'''
+        return self.tables.get(key, '')
+
+
+    @Com_call
+    def ZG(self):
+        '''Zero and go, starts the acquisition'''
+        self.app.active = self
+        self.row_times = self.Row_times()
+        self.acq_time = self.row_times.sum()
+        self.start = time.time()
+        self.stop = self.start + self.acq_time
+        self.data = None
+        self.aborted = False
+        self.interval = [self.start, self.stop]
+        self.app.acquisitions.append(self.interval)
+
+        # Acquisition info as TNMR reports it
+        self.params['Date'] = time.strftime('%Y/%m/%d %H:%M:%S')
+        self.params['Exp. Start Time'] = time.strftime('%H:%M:%S',
+            time.localtime(self.start))
+        self.params['Exp. Finish Time'] = time.strftime('%H:%M:%S',
+            time.localtime(self.stop))
+        return True
+
+
+    @property
+    @Com_call
+    def Abort(self):
+        '''Stops acquisition in this document'''
+        self.Stop()
+        return True
+
+
+    @property
+    @Com_call
+    def GetData(self):
+        '''Interleaved (R, I, R, I, ...) data, summed over the scans
+            done so far'''
+        return self.Cached_data()
+
+
+    @property
+    @Com_call
+    def GetDataSize(self):
+        '''Sizes of the 1D, 2D, 3D and 4D dimensions'''
+        return (self.Points(), self.Rows(), 1, 1)
+
+
+    @Com_call
+    def SaveAs(self, path):
+        '''Saves document, only remembers the path'''
+        self.path = path
+        return True
+
+
+    @Com_call
+    def Close(self):
+        '''Closes this document'''
+        if self not in self.app.documents: return False
+        self.app.documents.remove(self)
+        if self.app.active is self:
+            self.app.active = (self.app.documents[-1] if self.app.documents
+                else None)
+        return True
+
+
+    @Com_call
+    def Export(self, path, file_type):
+        '''Exports data as a TNMR text file'''
+        data = np.asarray(self.Cached_data()).reshape(-1, 2)
+        with open(path, 'w') as f:
+            f.write('TNMR text export\nPoints 1D\t{}\nPoints 2D\t{}\n'
+                'Real\tImaginary\n\n'.format(self.Points(), self.Rows()))
+            f.write('\n'.join('{:f}\t{:f}'.format(*row) for row in data))
+        return True
+
+
+    def Sequence_name(self):
+        '''File name of the loaded pulse program'''
+        return os.path.basename(self.sequence.replace('\\', '/'))
+
+
+    def Points(self):
+        '''Number of acquired complex points'''
+        return int(Get_time(self.params, 'Acq. Points')) or 1024
+
+
+    def Rows(self):
+        '''Number of 2D rows'''
+        return max(int(Get_time(self.params, 'Points 2D')), 1)
+
+
+    def Value(self, key, row):
+        '''Parameter in seconds, from the table in 2D'''
+        for name, values in self.tables.items():
+            if name.split(':')[0] == key:
+                values = values.split(' ') if type(values) == str else values
+                # Tables repeat if shorter than the 2D size
+                value = values[row % len(values)]
+                return ToN(value) if type(value) == str else value
+        return Get_time(self.params, key)
+
+
+    def Row_times(self):
+        '''Duration of each 2D row in seconds'''
+        keys = [name.split(':')[0] for name in self.tables]
+        settings = dict(self.params, **{'Points 2D': '1'})
+        times = np.array([Estimate_time(settings,
+            {key: [self.Value(key, row)] for key in keys})
+            for row in range(self.Rows())])
+
+        if SETTINGS['acq_time'] is not None:
+            total = times.sum()
+            if total > 0:
+                return times*SETTINGS['acq_time']/total
+            return np.full(len(times), SETTINGS['acq_time']/len(times))
+        return times*SETTINGS['time_scale']
+
+
+    def Scans(self):
+        '''Scans done in each 2D row'''
+        if self.start is None:
+            return np.zeros(self.Rows(), dtype=int)
+        scans = max(int(Get_time(self.params, 'Scans 1D')), 1)
+        if self.Finished() and not self.aborted:
+            return np.full(len(self.row_times), scans)
+
+        # Rows are acquired one after another, scan by scan
+        elapsed = min(time.time(), self.stop) - self.start
+        end = np.cumsum(self.row_times)
+        begin = end - self.row_times
+        done = np.where(elapsed >= end, scans, 0)
+        running = (elapsed >= begin) & (elapsed < end)
+        done[running] = (scans*(elapsed - begin[running])
+            /self.row_times[running]).astype(int)
+        return done
+
+
+    def Current_scans(self):
+        '''Scans done in the row being acquired, as Actual Scans 1D'''
+        scans = self.Scans()
+        started = np.nonzero(scans)[0]
+        return scans[started[-1]] if len(started) else 0
+
+
+    def Stop(self):
+        '''Ends the acquisition now'''
+        if self.stop is not None and time.time() < self.stop:
+            self.stop = time.time()
+            self.aborted = True
+            self.interval[1] = self.stop
+            self.params['Exp. Finish Time'] = time.strftime('%H:%M:%S',
+                time.localtime(self.stop))
+
+
+    def Finished(self):
+        '''Checks the simulated clock'''
+        return self.stop is None or time.time() >= self.stop
+
+
+    def Amplitude(self, row):
+        '''Echo amplitude of a single scan in row'''
+        amplitude = SETTINGS['amplitude']
+        amplitude *= np.exp(-2*self.Value('tau', row)/SETTINGS['T2'])
+        if self.Sequence_name() in INVERSION:
+            d5 = self.Value('d5', row) + self.Value('pre', row)
+            amplitude *= 1 - 2*np.exp(-d5/SETTINGS['T1'])
+        return amplitude
+
+
+    def Cached_data(self):
+        '''Data of the scans done so far, new noise is drawn only
+            once more scans are done, so GetData and Export agree'''
+        scans = self.Scans()
+        if self.data is None or not np.array_equal(scans, self.data_scans):
+            self.data = tuple(self.Synthetic_data(scans).tolist())
+            self.data_scans = scans
+        return self.data
+
+
+    def Synthetic_data(self, scans):
+        '''Echoes with noise summed over scans of each row,
+            as flat (R, I, R, I, ...) numpy array'''
+        rows = self.Rows()
+        dw = Get_time(self.params, 'Dwell Time') or 0.0000001
+        t = np.arange(self.Points())*dw
+        data = np.zeros((rows, len(t)), dtype=complex)
+
+        for row in range(rows):
+            # Echo forms tau after the refocusing pulse, window opens at ad
+            center = max(self.Value('tau', row) - self.Value('ad', row), 0)
+            data[row] = scans[row]*self.Amplitude(row)*np.exp(
+                -np.abs(t - center)/SETTINGS['T2star']
+                + 2j*np.pi*SETTINGS['offset']*(t - center))
+
+        # Noise adds up with the square root of scans
+        noise = RNG.normal(size=(rows, len(t), 2))
+        noise *= SETTINGS['noise']*np.sqrt(scans)[:, None, None]
+        return data.view(float).reshape(-1) + noise.reshape(-1)
+
+
+
+if __name__ == "__main__":
+    # Inversion recovery on the simulated sample, fit recovers T1
+    from T1 import Geometric_list
+    from Fit import Fit_curves
+
+    Configure(latency=0.001, time_scale=0.01, T1=0.005)
+    app = CreateObject('NTNMR.Application')
+    doc = CreateObject('NTNMR.Document')
+    doc.LoadSequence('three_pulse.tps')
+    d5_list = Geometric_list('10u', '100m', 16, shuffle=True)
+    for key, value in {'Scans 1D': '16', 'Last Delay': '100m', 'pre': '3u',
+            'tau': '35u', 'ad': '15u', 'Acq. Points': '1024',
+            'Dwell Time': '100n', 'Points 2D': str(len(d5_list))}.items():
+        doc.SetNMRParameter(key, value)
+    doc.SetTable('d5:2', str(d5_list))
+
+    doc.ZG()
+    while not app.CheckAcquisition:
+        print('Scans done:', doc.GetNMRParameter('Actual Scans 1D'))
+        time.sleep(0.1)
+
+    points, rows = doc.GetDataSize[:2]
+    data = np.asarray(doc.GetData).view(complex).reshape(rows, points)
+    # Echo amplitude with sign from the phase of the first point
+    y = (data[:, :50].sum(axis=1)*np.exp(-1j*np.angle(data[0, 0]))).real
+    t = d5_list.Measured() + 0.000003
+    p, errors = Fit_curves(t, y[None, :], 'exp')
+    print('T1 set {:.3g} s, fitted {:.3g} +- {:.2g} s'.format(
+        SETTINGS['T1'], p[0, 2], errors[0, 2]))
+    print('COM calls:', Reset_calls())
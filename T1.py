@@ -1,49 +1,115 @@
 # NMR string manipulation and list generation methods
 
+# Imports
+import copy
 
+import numpy as np  # Numpy for numerical operations
 
-def ToN(string):
-    '''Converts string number to a float'''
-    suffixes = {
-        'n':0.000000001,
-        'u':0.000001,
-        'm':0.001,
-        's':1
-    }
-    check = ('n','u','m','s')
-    if string.endswith(check):
-        #print(string)
-        return float(string[:-1])*suffixes[string[-1]]
-    else: return float(string)
+from Units import ToN    # Cached unit parsing, kept importable from here
+from Units import ToStr
+from Units import To_array
 
 
 
-def ToStr(num):
-    '''Converts number to string format with suffix'''
-    suffixes = {
-        0:'s',
-        1:'m',
-        2:'u',
-        3:'n',
-        4:'p'
-    }
+def Interleave_order(n):
+    '''Measurement order in 4 segments of every 4th value, so
+        a partial measurement still covers the whole range'''
+    return np.concatenate([np.arange(i, n, 4) for i in [0,2,1,3]])
 
-    # check for zero, return without suffix
-    if num == 0:
-        return '{:.3g}'.format(num) + suffixes[0]
 
-    # find correct suffix
-    count = 0
-    while num < 1 and count <4:
-        count += 1
-        num = num*1000
-    return '{:.3g}'.format(num) + suffixes[count]
+
+def Interleave(table):
+    '''Reorders table into 4 segments of every 4th value'''
+    return [table[i] for i in Interleave_order(len(table))]
+
+
+
+def Truncate(values):
+    '''Truncates delays in seconds to 0.1 us, floating point error
+        must not take a whole 0.1 us off, e.g. 10u must stay 10u'''
+    steps = np.round(np.asarray(values, dtype=float)*10**7, 6)
+    return np.floor(steps)/10**7
+
+
+
+class Delay_list():
+    '''Delays of a sweep as numbers and TNMR strings, in the
+        order in which they are measured'''
+
+    def __init__(self, values, order=None):
+        '''Initialization from delays in seconds
+            order: indices of values in measurement order'''
+        # Values are the source of truth, strings are formatted from them
+        # with all digits, so TNMR gets the same delays
+        self.values = np.array(values, dtype=float)
+        if order is None:
+            order = np.arange(len(self.values))
+        self.order = self.Check_order(order)
+
+
+    def Check_order(self, order):
+        '''Makes sure order is a permutation of all values'''
+        order = np.asarray(order, dtype=int)
+        if not np.array_equal(np.sort(order), np.arange(len(self.values))):
+            raise ValueError('Order is not a permutation of the delays')
+        return order
+
+
+    def Permute(self, order):
+        '''Same delays measured in another order'''
+        delays = copy.copy(self)
+        delays.order = self.Check_order(order)
+        return delays
+
+
+    def Interleave(self):
+        '''Same delays in 4 interleaved segments'''
+        return self.Permute(Interleave_order(len(self)))
+
+
+    def Shifted(self, offset):
+        '''Delays with offset in seconds added, in the same order'''
+        return Delay_list(self.values + offset, self.order)
+
+
+    def Measured(self):
+        '''Values in seconds in measurement order'''
+        return self.values[self.order]
+
+
+    def Strings(self):
+        '''TNMR strings in measurement order'''
+        return [ToStr(value, None) for value in self.Measured().tolist()]
+
+
+    def split(self, sep=' '):
+        '''Same as for the joined string list, which is joined by spaces'''
+        if sep != ' ':
+            raise ValueError('Delay lists are separated by spaces')
+        return self.Strings()
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+    def __str__(self):
+        '''String for TNMR tables, e.g. SetTable('d5:2', ...)'''
+        return ' '.join(self.Strings())
+
+
+
+def Values(delays):
+    '''Delays in seconds in measurement order, from a Delay_list
+        or a delay list string'''
+    if isinstance(delays, Delay_list):
+        return delays.Measured()
+    return To_array(delays)
 
 
 
 def Geometric_list(start, stop, n, shuffle=True):
-    '''Generates the string of d5 values to measure T1'''
-    print(start, stop)
+    '''Generates the d5 values to measure T1'''
     # Converts if input data are strings
     if type(start) == str:
         start = ToN(start)
@@ -54,30 +120,18 @@ def Geometric_list(start, stop, n, shuffle=True):
 
     # Creates geometric series
     mult = (stop/start)**(1./(n-1))
-    print(mult)
-
-    #table = [ToStr(start*(mult**i)) for i in range(n)]
-    table = [ToStr((start*(mult**i))*10**8//10/10**7) for i in range(n)]
-    print(table)
-
+    delays = Delay_list(Truncate(start*mult**np.arange(n)))
 
     # Parcels into 4 segments
     if shuffle:
-        temp = []
-        for i in [0,2,1,3]:
-            for j in range(n//4 + int(n%4>i)):
-                temp.append(4*j + i)
-        temp = temp[:n]
-        print(temp)
-        table = [table[i] for i in temp]
+        delays = delays.Interleave()
 
-    return ' '.join(table)
+    return delays
 
 
 
 def Arithmetic_list(step, n, start=0, shuffle=False):
-    '''Generates the string of d5 values to measure T1'''
-    print(step)
+    '''Generates the tau values to measure T2'''
     # Converts if input data are strings
     if type(step) == str:
         step = ToN(step)
@@ -87,19 +141,13 @@ def Arithmetic_list(step, n, start=0, shuffle=False):
         start = ToN(start)
 
     # Creates arithmetic series
-    table = [ToStr((i*step + start)*10**8//10/10**7) for i in range(n)]
+    delays = Delay_list(Truncate(np.arange(n)*step + start))
 
     # Parcels into 4 segments
     if shuffle:
-        temp = []
-        for i in [0,2,1,3]:
-            for j in range(n//4 + int(n%4>i)):
-                temp.append(4*j + i)
-        temp = temp[:n]
-        print(temp)
-        table = [table[i] for i in temp]
+        delays = delays.Interleave()
 
-    return ' '.join(table)
+    return delays
 
 
 
@@ -116,3 +164,67 @@ if __name__ == "__main__":
     print(Arithmetic_list('10u', 20, True))
 
 
+
+    # Same delays as the joined strings made before Delay_list
+    import random
+
+    def Old_ToStr(num):
+        suffixes = {0: 's', 1: 'm', 2: 'u', 3: 'n', 4: 'p'}
+        if num == 0:
+            return '{:.3g}'.format(num) + suffixes[0]
+        count = 0
+        while num < 1 and count < 4:
+            count += 1
+            num = num*1000
+        return '{:.3g}'.format(num) + suffixes[count]
+
+    def Old_shuffle(table):
+        n = len(table)
+        temp = []
+        for i in [0,2,1,3]:
+            for j in range(n//4 + int(n%4>i)):
+                temp.append(4*j + i)
+        return [table[i] for i in temp[:n]]
+
+    def Old_geometric(start, stop, n, shuffle):
+        start, stop = ToN(start), ToN(stop)
+        mult = (stop/start)**(1./(n-1))
+        table = [Old_ToStr((start*(mult**i))*10**8//10/10**7)
+            for i in range(n)]
+        return ' '.join(Old_shuffle(table) if shuffle else table)
+
+    def Old_arithmetic(step, n, start, shuffle):
+        step, start = ToN(step), ToN(start)
+        table = [Old_ToStr((i*step + start)*10**8//10/10**7)
+            for i in range(n)]
+        return ' '.join(Old_shuffle(table) if shuffle else table)
+
+    random.seed(0)
+    lists = carried = 0
+    for i in range(3000):
+        n = random.randint(2, 200)
+        shuffle = random.random() < 0.5
+        start = '{:.3g}u'.format(10**random.uniform(0, 3))
+        stop = '{:.3g}m'.format(10**random.uniform(0, 3))
+        step = '{:.3g}u'.format(10**random.uniform(0, 3))
+        for old, new in [
+                (Old_geometric(start, stop, n, shuffle),
+                    Geometric_list(start, stop, n, shuffle)),
+                (Old_arithmetic(step, n, start, shuffle),
+                    Arithmetic_list(step, n, start, shuffle))]:
+            lists += 1
+            # Old strings were the same delays rounded to 3 digits
+            assert np.allclose(To_array(old), new.Measured(), rtol=0.005,
+                atol=10**-7)
+            # New strings keep all digits of the delays
+            assert np.allclose(To_array(str(new)), new.Measured(),
+                rtol=1e-12, atol=0)
+            carried += sum(len(b) > len(a)
+                for a, b in zip(old.split(' '), new.Strings()))
+    print('Same delays as before for', lists, 'lists,', carried,
+        'values no longer rounded')
+
+    # Any measurement order, e.g. alternating long and short delays
+    d5_list = Geometric_list('10u', '1s', 8, shuffle=False)
+    print(d5_list.Permute([7, 0, 6, 1, 5, 2, 4, 3]))
+    print(d5_list.Measured())
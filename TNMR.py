@@ -1,30 +1,47 @@
 # Communication with windows API devices
-import comtypes
-from comtypes.client import CreateObject
-from comtypes.client import GetActiveObject
+try:
+    from comtypes.client import CreateObject
+    from comtypes.client import GetActiveObject
+except ImportError:
+    # No COM outside windows, only the simulation can be used
+    CreateObject = GetActiveObject = None
 
 #import os # For compiling file paths
-import time
 
 from T1 import Geometric_list
 from T1 import Arithmetic_list
+from Acquisition import Acquisition_waiter
+from Acquisition import Estimate_time
+from Document import Cached_document
+import Simulation
 
 
 
 class Tecmag():
     '''Creates application class for TNMR communication'''
 
-    def __init__(self):
+    def __init__(self, simulate=False):
+        # Choose real or simulated TNMR
+        if simulate:
+            self.CreateObject = Simulation.CreateObject
+            self.GetActiveObject = Simulation.GetActiveObject
+        else:
+            self.CreateObject = CreateObject
+            self.GetActiveObject = GetActiveObject
+
         self.Open_TNMR()
 
+        # Waits for the end of measurements
+        self.waiter = Acquisition_waiter(self.app)
+
     
     def Open_TNMR(self):
         '''Finds TNMR window or creates new one'''
         try:
-            self.app = GetActiveObject('NTNMR.Application')
+            self.app = self.GetActiveObject('NTNMR.Application')
             print('Found existing TNMR window')
         except OSError:
-            self.app = CreateObject('NTNMR.Application')
+            self.app = self.CreateObject('NTNMR.Application')
             print('Opening new TNMR window')
             # Close the empty document
             if self.app.CloseFile(''): pass
@@ -70,7 +87,8 @@ class Tecmag():
             params['D5max'], params['D5N'], shuffle=False)
 
         # with makes sure that communication correctly aborts in the end
-        with TNMR_document(file_path, file_name, self.app) as doc:
+        with TNMR_document(file_path, file_name, self.app,
+                self.CreateObject) as doc:
             doc.LoadSequence(pulse_path + pulse_file)
 
             # Set regular parameters
@@ -82,14 +100,17 @@ class Tecmag():
                     params[self.nmrparam_dict[param]])
 
             # Set d5 table
-            doc.SetTable('d5:2', d5_list)
+            doc.SetTable('d5:2', str(d5_list))
 
             # Display all three lines on graph
             doc.SetNMRParameter('Data Type',
                 'Real, Imaginary, Magnitude')
 
             # Start measurement and write data
-            self.data_T1 = self.Run_measurement(doc)
+            settings = {param: params[self.nmrparam_dict[param]]
+                for param in self.nmrparam_dict}
+            self.data_T1 = self.Run_measurement(doc,
+                Estimate_time(settings, {'d5': d5_list.Measured()}))
 
             # Save file and export data
             doc.SaveAs(file_path + file_name + '.tnt')
@@ -134,7 +155,8 @@ class Tecmag():
         #print(dtau_list)
 
         # with makes sure that communication correctly aborts in the end
-        with TNMR_document(file_path, file_name, self.app) as doc:
+        with TNMR_document(file_path, file_name, self.app,
+                self.CreateObject) as doc:
             doc.LoadSequence(pulse_path + pulse_file)
 
             # Set regular parameters
@@ -151,7 +173,10 @@ class Tecmag():
             #doc.SetNMRParameter('deltatau', params['dTAU'])
 
             # Start measurement and write data
-            self.data_T2 = self.Run_measurement(doc)
+            settings = {param: params[self.nmrparam_dict[param]]
+                for param in self.nmrparam_dict}
+            self.data_T2 = self.Run_measurement(doc,
+                Estimate_time(settings))
 
             # Save file and export data
             doc.SaveAs(file_path + file_name + '.tnt')
@@ -186,7 +211,8 @@ class Tecmag():
         }
 
         # with makes sure that communication correctly aborts in the end
-        with TNMR_document(file_path, file_name, self.app) as doc:
+        with TNMR_document(file_path, file_name, self.app,
+                self.CreateObject) as doc:
             doc.LoadSequence(pulse_path + pulse_file)
 
             # Set regular parameters
@@ -202,26 +228,26 @@ class Tecmag():
                 'Real, Imaginary, Magnitude')
 
             # Start measurement and write data
-            self.data_FID = self.Run_measurement(doc)
+            settings = {param: params[self.nmrparam_dict[param]]
+                for param in self.nmrparam_dict}
+            self.data_FID = self.Run_measurement(doc,
+                Estimate_time(settings))
 
             # Save file and export data
             doc.SaveAs(file_path + file_name + '.tnt')
             doc.Export(file_path + file_name + '.txt', 0)
 
     
-    def Run_measurement(self, doc):
+    def Run_measurement(self, doc, expected=0):
         '''Runs measurement on doc, waits till finished 
-            Possibly return data once done'''
+            Possibly return data once done
+            expected: estimated duration in seconds'''
         print('Starting measurement')
         # Zero and go
         doc.ZG()
 
-        # Cehcks if the measurement is finished
-        while not self.app.CheckAcquisition: # End loop when finished
-            print('Measurement in progress')
-            time.sleep(10)
-        
-        print('Measurement finished')
+        # Waits until the measurement is finished
+        self.waiter.Wait(expected)
 
         return doc.GetData
 
@@ -316,19 +342,21 @@ class TNMR_document():
     '''Class that opens a TNMR document, returns reference to it
     and makes sure to save and close when finished using with'''
 
-    def __init__(self, file_path, file_name, app):
-        '''Initialization when class is called, reference to TNMR app'''
+    def __init__(self, file_path, file_name, app, create=CreateObject):
+        '''Initialization when class is called, reference to TNMR app
+            and the function creating COM objects'''
         print('init!!')
         self.file_path = file_path
         self.file_name = file_name
         self.app = app
+        self.create = create
         print(file_path, file_name, app)
 
 
     def __enter__(self):
         '''Entering functions when class is started up with with'''
         print('entering')
-        self.doc = CreateObject('NTNMR.Document')
+        self.doc = Cached_document(self.create('NTNMR.Document'))
         return self.doc
 
 
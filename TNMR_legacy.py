@@ -5,19 +5,37 @@
 
 
 # Communication with windows API devices
-import comtypes
-from comtypes.client import CreateObject
-from comtypes.client import GetActiveObject
+try:
+    from comtypes.client import CreateObject
+    from comtypes.client import GetActiveObject
+except ImportError:
+    # No COM outside windows, only the simulation can be used
+    CreateObject = GetActiveObject = None
 
 #import os # For compiling file paths
-import time
+import datetime
+
+import numpy as np  # Numpy for numerical operations
 
 from T1 import Geometric_list
 from T1 import Arithmetic_list
 from T1 import ToN
-from T1 import ToStr
 from NMR7 import Legacy_export
 from NMR7 import Legacy_G
+from NMR7 import Acquired_scans
+from Acquisition import Acquisition_waiter
+from Acquisition import Estimate_time
+from Acquisition import Row_times
+from Document import Cached_document
+from Document import Document_pool
+from Writer import Export_writer
+from Writer import Serial_writer
+from Binary import Export_all
+from Design import Optimal_list
+from Profiler import Com_stats
+from Profiler import PROFILE_FILE
+from Trace import No_tracer
+import Simulation
 
 # Global variables
 MEAS_LOOP_TIME = 2 # time in seconds how often python interacts with tnmr
@@ -26,25 +44,93 @@ MEAS_LOOP_TIME = 2 # time in seconds how often python interacts with tnmr
 class Tecmag():
     '''Creates application class for TNMR communication'''
 
-    def __init__(self):
+    def __init__(self, simulate=False, pool_size=2, profile=False):
+        '''Initialization, pool_size: number of idle documents kept open
+            for reuse, 0 opens a new document for every measurement
+            profile: record COM calls and log them to PROFILE_FILE,
+                or to the given log file'''
+        # Choose real or simulated TNMR
+        if simulate:
+            self.CreateObject = Simulation.CreateObject
+            self.GetActiveObject = Simulation.GetActiveObject
+        else:
+            self.CreateObject = CreateObject
+            self.GetActiveObject = GetActiveObject
+
+        # Record all calls to TNMR objects
+        if profile:
+            self.stats = Com_stats(profile if type(profile) == str
+                else PROFILE_FILE)
+            self.CreateObject = self.stats.Wrap(self.CreateObject)
+            self.GetActiveObject = self.stats.Wrap(self.GetActiveObject)
+        else:
+            self.stats = None
+
         self.Open_TNMR()
 
+        # Waits for the end of measurements
+        self.waiter = Acquisition_waiter(self.app,
+            poll_slow=MEAS_LOOP_TIME)
+
+        # Reuses documents with loaded sequences
+        if pool_size:
+            self.pool = Document_pool(self.app, self.CreateObject, pool_size)
+        else:
+            self.pool = None
+
+        # Export files while the next point is measured
+        self.background = True
+        # Also export binary FID files next to .DAT
+        self.binary = False
+        # Journal of finished points for resuming, e.g. Job_store
+        self.store = None
+        # Timeline of measurement phases, e.g. Trace.Tracer
+        self.tracer = No_tracer()
+        # Processes analysing points during the sweep, e.g. Analysis_pool
+        self.analysis = None
+        # Shared memory with the latest points for live views, Ring_buffer
+        self.ring = None
+        # Follows averaging and stops points at a target SNR, Snr_monitor
+        self.snr_monitor = None
+
     
     def Open_TNMR(self):
         '''Finds TNMR window or creates new one'''
         try:
-            self.app = GetActiveObject('NTNMR.Application')
+            self.app = self.GetActiveObject('NTNMR.Application')
             print('Found existing TNMR window')
         except OSError:
-            self.app = CreateObject('NTNMR.Application')
+            self.app = self.CreateObject('NTNMR.Application')
             print('Opening new TNMR window')
             # Close the empty document
             if self.app.CloseFile(''): pass
             else: print('Failed to close starting file')
 
 
+    def Close(self):
+        '''Closes the idle documents kept for reuse and the COM log'''
+        if self.pool is not None:
+            self.pool.Close()
+        if self.stats is not None:
+            self.stats.Close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, e_type, e_value, e_traceback):
+        self.Close()
+
+
     def Get_FID(self, params):
         ''' Measure a single FID'''
+        return self.Run_measurement(self.FID_params(params), params)
+
+
+    def FID_params(self, params):
+        '''Prepares params for two pulse echo, returns dictionary
+            of TNMR parameters and their keys in params'''
         # File path for pulse programs
         pulse_path = 'C:\\TNMR\\sequences\\'
         pulse_file = 'two_pulse.tps'
@@ -53,9 +139,6 @@ class Tecmag():
         params['pulse_path'] = pulse_path
         params['pulse_file'] = pulse_file
 
-        file_path = params['file_path']
-        file_name = params['file_name']
-
         # Define dictionary of parameters for this two pulse experiment
         nmrparam = {
             # Pulse parameters
@@ -94,12 +177,17 @@ class Tecmag():
         # Add to main params
         nmrparam.update(default_params)
 
-        #return data
-        return self.Run_measurement(nmrparam, params)
+        return nmrparam
 
 
     def Get_INV(self, params):
         ''' Measure a single FID'''
+        return self.Run_measurement(self.INV_params(params), params)
+
+
+    def INV_params(self, params):
+        '''Prepares params for three pulse inversion, returns dictionary
+            of TNMR parameters and their keys in params'''
         # File path for pulse programs
         pulse_path = 'C:\\TNMR\\sequences\\'
         pulse_file = 'three_pulse.tps'
@@ -108,9 +196,6 @@ class Tecmag():
         params['pulse_path'] = pulse_path
         params['pulse_file'] = pulse_file
 
-        file_path = params['file_path']
-        file_name = params['file_name']
-
         # Define dictionary of parameters for this two pulse experiment
         nmrparam = {
             # Pulse parameters
@@ -153,37 +238,49 @@ class Tecmag():
         # Add to main params
         nmrparam.update(default_params)
 
-        #return data
-        return self.Run_measurement(nmrparam, params)
+        return nmrparam
 
 
-    def Get_T1(self, params):
-        '''Takes Params and makes T1 measurement'''
-        # Generate D5 list
-        d5_list = Geometric_list(params['D5min'],
-            params['D5max'], params['D5N'], shuffle=True)
+    def Get_T1(self, params, single=True, estimator=None):
+        '''Takes Params and makes T1 measurement
+            single: measure all D5 in one 2D document if possible
+            estimator: Online_fit choosing the order of D5 and stopping
+                once T1 is precise enough, measures point by point'''
+        # Generate D5 list, optimized for the expected T1 if known
+        if params.get('T1prior'):
+            d5_list = Optimal_list(params, params['T1prior'],
+                ToN(params.get('T1prec', '0.05')))
+        else:
+            d5_list = Geometric_list(params['D5min'],
+                params['D5max'], params['D5N'], shuffle=True)
 
         # Remember file name
         file_name = params['file_name']
 
-        # Make a fake .G file
-        Legacy_G(d5_list, params)
-
-        # Do all measurements
-        for i, d5 in enumerate(d5_list.split(' ')):
-            # Assign D5 and file name
-            params['D5'] = d5
-            # Reduce to accomodate for prepulse
-            params['D5meas'] = ToStr(ToN(d5) - ToN(params['pre']))
-            params['file_name'] = file_name + '-' + (str(1000+i+1)[-3:])
-
-            # Measure FID (three pulse inversion) and legacy export
-            data = self.Get_INV(params)
-            Legacy_export(data, params)
-
-
-    def Get_T2(self, params):
-        '''Takes Params and makes T1 measurement'''
+        # Assign D5 and file name to each point
+        # Reduce to accomodate for prepulse
+        d5meas_list = d5_list.Shifted(-ToN(params['pre']))
+        points = list()
+        for i, (d5, d5meas) in enumerate(zip(d5_list.Strings(),
+                d5meas_list.Strings())):
+            points.append({
+                'D5': d5,
+                'D5meas': d5meas,
+                'file_name': file_name + '-' + (str(1000+i+1)[-3:])
+            })
+
+        # Measure FID (three pulse inversion), legacy export and .G file
+        self.Run_sweep(self.INV_params(params), params, points,
+            {'d5': 'D5meas'}, single, estimator, g_key='D5')
+
+        # Fit T1 once the workers have analysed all points
+        if self.analysis is not None:
+            self.analysis.Fit(file_name, 'D5', 'exp')
+
+
+    def Get_T2(self, params, single=True):
+        '''Takes Params and makes T2 measurement
+            single: measure all TAU in one 2D document if possible'''
         # Generate D5 list
         tau_list = Arithmetic_list(params['dTAU'], params['TAUN'],
             start=params['TAUmin'], shuffle=True)
@@ -191,53 +288,221 @@ class Tecmag():
         # Remember file name
         file_name = params['file_name']
 
-        # Make a fake .G file
-        Legacy_G(tau_list, params)
-
-        # Do all measurements
-        for i, tau in enumerate(tau_list.split(' ')):
-            # Assign D5 and file name
-            params['TAU'] = tau
-            params['ad'] = ToStr(ToN(tau) - ToN(params['TAUmin'])
-                 + ToN(params['adT2']))
-            params['file_name'] = file_name + '-' + (str(1000+i+1)[-3:])
-
-            # Measure FID (three pulse inversion) and legacy export
-            data = self.Get_FID(params)
-            Legacy_export(data, params)
-
-
-    def Run_measurement(self, nmrparam, params):
+        # Assign TAU, acquisition delay and file name to each point
+        ad_list = tau_list.Shifted(ToN(params['adT2']) - ToN(params['TAUmin']))
+        points = list()
+        for i, (tau, ad) in enumerate(zip(tau_list.Strings(),
+                ad_list.Strings())):
+            points.append({
+                'TAU': tau,
+                'ad': ad,
+                'file_name': file_name + '-' + (str(1000+i+1)[-3:])
+            })
+
+        # Measure FID (two pulse echo), legacy export and .G file
+        self.Run_sweep(self.FID_params(params), params, points,
+            {'tau': 'TAU', 'ad': 'ad'}, single, g_key='TAU')
+
+        # Fit T2 once the workers have analysed all points
+        if self.analysis is not None:
+            self.analysis.Fit(file_name, 'TAU', 'decay')
+
+
+    def Run_sweep(self, nmrparam, params, points, tables, single=True,
+            monitor=None, g_key=None):
+        '''Measures a series of points and exports each to 7NMR format
+            points: list of params updates for each point
+            tables: swept TNMR parameters and their keys in params
+            single: measure all points in one 2D document if possible
+            monitor: chooses points one by one with Next(points) and
+                gets the results with Add(point, data), e.g. Online_fit
+            g_key: key of params listed in the .G file, which only holds
+                the points exported so far'''
+        # Choosing points or stopping them at an SNR needs one document each
+        if monitor is not None or self.snr_monitor is not None:
+            single = False
+
+        # Series name, before params take the names of points
+        name = params['file_name']
+        if self.stats is not None:
+            self.stats.Start(name)
+        if self.store is not None:
+            # Continue an interrupted series where it stopped
+            points = self.store.Plan(name, params['pulse_file'], params,
+                points)
+        self.tracer.Mark('Sweep', series=name, points=len(points))
+
+        # Points with files, also those of an interrupted run
+        if self.store is not None:
+            exported = self.store.Measured(name)
+        else:
+            exported = list()
+
+        # Export, then record the point as finished
+        def Export(data, params):
+            with self.tracer.Span('Export', point=params['file_name']):
+                if self.binary:
+                    with self.tracer.Span('Binary export'):
+                        Export_all(data, params)
+                else:
+                    with self.tracer.Span('Legacy export'):
+                        Legacy_export(data, params)
+                if self.store is not None:
+                    self.store.Done(name, params)
+                if g_key is not None:
+                    # Make a fake .G file, in the order of the file names
+                    exported.append(params)
+                    exported.sort(key=lambda point: point['file_name'])
+                    Legacy_G([point[g_key] for point in exported],
+                        {'file_path': params['file_path'], 'file_name': name})
+
+        # Writes exports in the background, or directly if disabled
+        if self.background:
+            writer = Export_writer(Export)
+        else:
+            writer = Serial_writer(Export)
+
+        with writer:
+            if single and points:
+                # Swept parameters go to tables, the rest is fixed
+                fixed = {key: value for key, value in nmrparam.items()
+                    if key not in tables}
+                table_values = {key: ' '.join(point[value] for point in points)
+                    for key, value in tables.items()}
+
+                # Whole series in one document
+                data = self.Run_measurement(fixed, params, table_values)
+                if data is not None:
+                    # Each point gets the times of its own row
+                    times = self.Point_times(params, {key: params[value]
+                        for key, value in fixed.items()}, table_values)
+                    # Split into one slice per point
+                    size = len(data)//len(points)
+                    for i, point in enumerate(points):
+                        params.update(point)
+                        params.update(times[i])
+                        self.Publish(writer, data[i*size:(i+1)*size],
+                            params, name)
+                    points = list()
+                else:
+                    print('Sequence has no tables', list(tables),
+                        'measuring point by point')
+
+            # One document per point
+            left = list(points)
+            while left:
+                if monitor is None:
+                    point = left.pop(0)
+                else:
+                    # Monitor chooses the next point or stops
+                    i = monitor.Next(left)
+                    if i is None:
+                        print('Skipping', len(left), 'points')
+                        break
+                    point = left.pop(i)
+
+                params.update(point)
+                data = self.Run_measurement(nmrparam, params)
+                # Next point starts while this one is written
+                data = self.Publish(writer, data, params, name)
+                if monitor is not None:
+                    monitor.Add(point, data)
+
+        # All points are written
+        if self.store is not None:
+            self.store.Finish(name)
+
+        # Where the time of the sweep went
+        if self.stats is not None:
+            self.stats.Report()
+
+
+    def Publish(self, writer, data, params, series):
+        '''Hands a measured point to the export writer, the ring
+            buffer and the analysis workers. The export formats divide
+            the summed data by NS themselves, the ring and the workers
+            get the data per scan, which is also returned'''
+        writer.Put(data, params)
+        # Points stopped at a target SNR have fewer scans than planned
+        data = np.asarray(data, dtype=float)/max(Acquired_scans(params), 1)
+        if self.ring is not None:
+            self.ring.Write(data, params['file_name'])
+        if self.analysis is not None:
+            self.analysis.Put(data, params, series)
+        return data
+
+
+    def Run_measurement(self, nmrparam, params, tables=None):
         '''Runs measurement on doc, waits till finished 
-            Possibly return data once done'''
+            Possibly return data once done
+            tables: TNMR parameters swept in 2D and their value strings,
+                returns None if the sequence does not support them'''
+        if self.stats is not None:
+            self.stats.Point(params['file_name'])
+        # Scans of the previous point
+        params.pop('NSacq', None)
+
         # with makes sure that communication aborts correctly
-        with TNMR_document(params['file_path'], params['file_name'], self.app) as doc:
+        document = TNMR_document(params['file_path'], params['file_name'],
+            self.app, self.CreateObject,
             # Loads file program
-            doc.LoadSequence(params['pulse_path'] + params['pulse_file'])
-
+            params['pulse_path'] + params['pulse_file'], self.pool,
+            self.tracer)
+        with self.tracer.Span('Measurement', point=params['file_name']), \
+                document as doc:
             # Set the parameters in file
-            for key, value in nmrparam.items():
-                doc.SetNMRParameter(key, params[value])
+            with self.tracer.Span('Parameter push'):
+                settings = {key: params[value]
+                    for key, value in nmrparam.items()}
+                for key, value in settings.items():
+                    doc.SetNMRParameter(key, value)
+
+                # Set the 2D tables
+                if tables:
+                    if not self.Has_tables(doc, tables):
+                        # Nothing measured, discard the document
+                        document.save = False
+                        return None
+                    for key, value in tables.items():
+                        doc.SetTable(key + ':2', value)
+                    rows = len(list(tables.values())[0].split(' '))
+                else:
+                    rows = 1
+                # Reused documents may still be set up for 2D
+                doc.SetNMRParameter('Points 2D', str(rows))
 
             # Measure
             print('Starting measurement')
             # Zero and go
-            doc.ZG()
+            with self.tracer.Span('ZG'):
+                doc.ZG()
+
+            # Waits until the measurement is finished
+            with self.tracer.Span('Wait'):
+                if self.snr_monitor is not None and not tables:
+                    # Reads the partial data while waiting
+                    self.snr_monitor.Start(self.app, doc)
+                    self.waiter.check = self.snr_monitor.Check
+                try:
+                    self.waiter.Wait(Estimate_time(settings, tables))
+                finally:
+                    self.waiter.check = self.waiter.Check_app
+
+            with self.tracer.Span('Data fetch'):
+                # Read parameters from file
+                self.Get_parameters(doc, params)
+
+                # Return Re Im data
+                return doc.GetData
 
-            # Checks if the measurement is finished
-            while not self.app.CheckAcquisition: # End loop when finished
-                print('Measurement in progress')
-                time.sleep(MEAS_LOOP_TIME)
-        
-            print('Measurement finished')
-            
-            # Read parameters from file
-            self.Get_parameters(doc, params)
+        # Exit on with saves file and exports          
 
-            # Return Re Im data
-            return doc.GetData 
 
-        # Exit on with saves file and exports          
+    def Has_tables(self, doc, tables):
+        '''Checks if the loaded sequence has all the tables'''
+        names = [name.split(':')[0].strip()
+            for name in doc.GetTableList.split(',')]
+        return all(key in names for key in tables)
 
 
     def Get_parameters(self, doc, params):
@@ -251,14 +516,49 @@ class Tecmag():
         date = doc.GetNMRParameter('Date')
         date = '.'.join(reversed(date.split(' ')[0].split('/')))
 
-        # Get actual NS
+        # Get actual NS, NS stays as planned for the next point
         ns = doc.GetNMRParameter('Actual Scans 1D')
 
         # Write to params
         params['DATESTA'] = date
         params['TIMESTA'] = start
         params['TIMEEND'] = finish
-        params['NS'] = ns
+        params['NSacq'] = ns
+
+
+    def Point_times(self, params, settings, tables):
+        '''Start and end of each row of a 2D acquisition, as DATESTA,
+            TIMESTA and TIMEEND updates of params. TNMR only reports the
+            times of the whole document, they are divided between the
+            rows in proportion to their expected durations'''
+        rows = Row_times(settings, tables)
+        try:
+            date = params['DATESTA'] + ' '
+            start = datetime.datetime.strptime(date + params['TIMESTA'],
+                '%d.%m.%Y %H:%M:%S')
+            end = datetime.datetime.strptime(date + params['TIMEEND'],
+                '%d.%m.%Y %H:%M:%S')
+        except ValueError:
+            print('Cannot read acquisition times, all points get the same')
+            return [dict() for row in rows]
+        # Finished after midnight
+        if end < start:
+            end += datetime.timedelta(days=1)
+
+        total = sum(rows)
+        scale = (end - start).total_seconds()/total if total > 0 else 0
+        times = list()
+        elapsed = 0
+        for row in rows:
+            begin = start + datetime.timedelta(seconds=elapsed*scale)
+            elapsed += row
+            finish = start + datetime.timedelta(seconds=elapsed*scale)
+            times.append({
+                'DATESTA': begin.strftime('%d.%m.%Y'),
+                'TIMESTA': begin.strftime('%H:%M:%S'),
+                'TIMEEND': finish.strftime('%H:%M:%S')
+            })
+        return times
 
 
     def Test_params(self):
@@ -299,6 +599,9 @@ class Tecmag():
         params['D5min'] = '1u'
         params['D5max'] = '1s'
         params['adT1'] = '15u'       # Acquisiton delay
+        params['T1prior'] = ''      # Expected T1, optimizes D5 list if set
+        params['T1prec'] = '0.05'   # Target relative T1 precision
+        params['T1snr'] = '20'      # Signal to noise of a point for T1prior
         params['D5'] = '4u'         # D5 var value, adds to list :S
 
         # T2
@@ -326,17 +629,39 @@ class TNMR_document():
     '''Class that opens a TNMR document, returns reference to it
     and makes sure to save and close when finished using with'''
 
-    def __init__(self, file_path, file_name, app):
-        '''Initialization when class is called, reference to TNMR app'''
+    def __init__(self, file_path, file_name, app, create=CreateObject,
+            sequence=None, pool=None, tracer=None):
+        '''Initialization when class is called, reference to TNMR app
+            and the function creating COM objects
+            sequence: pulse program to load
+            pool: Document_pool to take the document from and return it to
+            tracer: records the time of opening and saving'''
         self.file_path = file_path
         self.file_name = file_name
         self.app = app
+        self.create = create
+        self.sequence = sequence
+        self.pool = pool
+        self.tracer = No_tracer() if tracer is None else tracer
+        # Set to False to close without saving
+        self.save = True
 
 
     def __enter__(self):
         '''Entering functions when class is started up with with'''
         print('Creating:', self.file_path, self.file_name)
-        self.doc = CreateObject('NTNMR.Document')
+        if self.pool is not None:
+            # Document with the sequence already loaded
+            with self.tracer.Span('Document create', pooled=True):
+                self.doc = self.pool.Acquire(self.sequence)
+        else:
+            with self.tracer.Span('Document create', pooled=False):
+                self.doc = Cached_document(self.create('NTNMR.Document'))
+            if self.sequence is not None:
+                with self.tracer.Span('Sequence load'):
+                    self.doc.LoadSequence(self.sequence)
+        # Pooled documents keep counting, report only this measurement
+        self.counts = (self.doc.writes, self.doc.skipped)
         return self.doc
 
 
@@ -351,12 +676,21 @@ class TNMR_document():
                     self.app.Abort
         else:
             print('Closing measurement', self.file_name)
+        print('Parameters written:', self.doc.writes - self.counts[0],
+            'skipped:', self.doc.skipped - self.counts[1])
 
         # Save document and close it
-        self.doc.SaveAs(self.file_path + self.file_name + '.tnt')
+        if self.save:
+            with self.tracer.Span('Save'):
+                self.doc.SaveAs(self.file_path + self.file_name + '.tnt')
         #self.doc.Export(self.file_path + self.file_name + '.txt', 0)
 
-        if not self.app.CloseActiveFile: print('Failed to close file')
+        if self.pool is not None and e_value == None:
+            # Keep open for the next measurement
+            self.pool.Release(self.sequence, self.doc)
+        elif self.pool is not None:
+            self.pool.Close_document(self.doc)
+        elif not self.app.CloseActiveFile: print('Failed to close file')
     
         #return True # Supresses errors in code
 
@@ -377,6 +711,7 @@ if __name__ == "__main__":
 
     A.params['file_name'] = 'T1-' + A.params['file_key']
     A.Get_T1(A.params)
+    A.Close()
 
     #A.params['file_name'] = 'T2-' + A.params['file_key']
     #A.Get_T2(A.params)
@@ -0,0 +1,155 @@
+# Timeline of measurement phases in Chrome trace format, view the file
+# in chrome://tracing or ui.perfetto.dev
+
+# Imports
+import os
+import json
+import time
+import threading
+import contextlib
+
+# Global variables
+TRACE_FILE = 'trace.json'
+# Spans during which the instrument is acquiring
+ACQUISITION = ('ZG', 'Wait')
+
+
+
+class Tracer():
+    '''Records spans of measurement phases, streamed to a trace file
+        so a crash still leaves a readable timeline'''
+
+    def __init__(self, file_path=TRACE_FILE):
+        '''Opens the trace file, an existing one is replaced'''
+        self.file_path = file_path
+        self.pid = os.getpid()
+        # Spans end in the acquisition and in the writer thread
+        self.lock = threading.Lock()
+        self.file = open(file_path, 'w')
+        self.file.write('[\n')
+
+
+    @contextlib.contextmanager
+    def Span(self, name, **args):
+        '''Records the time spent in the with block as name'''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.Event({'name': name, 'ph': 'X', 'ts': 1000000*start,
+                'dur': 1000000*(time.time() - start), 'args': args})
+
+
+    def Mark(self, name, **args):
+        '''Records an instant event, e.g. start of a sweep'''
+        self.Event({'name': name, 'ph': 'i', 's': 'p',
+            'ts': 1000000*time.time(), 'args': args})
+
+
+    def Event(self, event):
+        '''Writes event of the calling thread to the trace'''
+        event.update({'cat': 'TNMR', 'pid': self.pid,
+            'tid': threading.get_ident()})
+        with self.lock:
+            if self.file is None: return
+            self.file.write(json.dumps(event) + ',\n')
+            self.file.flush()
+
+
+    def Close(self):
+        '''Ends the trace file as valid JSON'''
+        with self.lock:
+            if self.file is None: return
+            self.file.write(json.dumps({'name': 'process_name', 'ph': 'M',
+                'pid': self.pid, 'args': {'name': 'TNMR'}}) + '\n]\n')
+            self.file.close()
+            self.file = None
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, e_type, e_value, e_traceback):
+        self.Close()
+
+
+
+class No_tracer():
+    '''Tracer that records nothing, same interface'''
+
+    @contextlib.contextmanager
+    def Span(self, name, **args):
+        yield
+
+
+    def Mark(self, name, **args):
+        pass
+
+
+    def Close(self):
+        pass
+
+
+
+def Load(file_path=TRACE_FILE):
+    '''Reads events of a trace file, also one that was not closed'''
+    with open(file_path) as f:
+        text = f.read().rstrip()
+    if not text.endswith(']'):
+        text = text.rstrip(',') + ']'
+    return json.loads(text)
+
+
+
+def Duty_cycle(events, names=ACQUISITION):
+    '''Fraction of time the instrument was acquiring between the first
+        and the last span, and the gaps between acquisitions in seconds'''
+    spans = sorted((event['ts'], event['ts'] + event['dur'])
+        for event in events if event.get('ph') == 'X')
+    busy = sorted((event['ts'], event['ts'] + event['dur'])
+        for event in events if event.get('name') in names)
+    if not busy:
+        return 0., list()
+
+    # Merge touching spans like ZG and the following Wait
+    merged = [list(busy[0])]
+    for start, end in busy[1:]:
+        if start <= merged[-1][1] + 1000:   # Within 1 ms
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    total = spans[-1][1] - spans[0][0]
+    acquiring = sum(end - start for start, end in merged)
+    gaps = [(merged[i + 1][0] - merged[i][1])/1000000
+        for i in range(len(merged) - 1)]
+    return acquiring/total, gaps
+
+
+
+if __name__ == "__main__":
+    # Trace a short T1 sweep on simulated TNMR
+    import io
+    import sys
+    import tempfile
+
+    from TNMR_legacy import Tecmag
+
+    A = Tecmag(simulate=True)
+    A.Test_params()
+    A.params['file_path'] = tempfile.mkdtemp() + os.sep
+    os.mkdir(A.params['file_path'] + 'export\\')
+    A.params.update({'NS': '2', 'D9': '20m', 'D5min': '10u', 'D5max': '10m',
+        'D5N': '8', 'file_name': 'T1-trace'})
+
+    file_path = sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE
+    A.tracer = Tracer(file_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        A.Get_T1(A.params, single=False)
+    A.tracer.Close()
+
+    duty, gaps = Duty_cycle(Load(file_path))
+    print('Duty cycle {:.1%}, mean gap between acquisitions {:.1f} ms'.format(
+        duty, 1000*sum(gaps)/len(gaps)))
+    print('Trace written to', file_path)
@@ -0,0 +1,149 @@
+# Conversion between TNMR value strings like '3u', '10ms' or '25.98MHz'
+# and numbers, cached for values repeated in every sweep
+
+# Imports
+import re
+from functools import lru_cache
+
+import numpy as np  # Numpy for numerical operations
+
+# Global variables
+PREFIXES = {
+    'p': 0.000000000001,
+    'n': 0.000000001,
+    'u': 0.000001,
+    'm': 0.001,
+    '': 1,
+    'k': 1000.,
+    'M': 1000000.,
+    'G': 1000000000.
+}
+# Suffixes written by ToStr, from seconds down
+SUFFIXES = ('', 'm', 'u', 'n', 'p')
+
+# Number, optional prefix and optional unit (seconds or Hz)
+VALUE = re.compile(r'''\s*
+    ([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)     # Number
+    \s*([pnumkMG]?)                                 # Prefix
+    (s|[Hh][Zz])?                                   # Unit
+    \s*$''', re.VERBOSE)
+
+
+
+@lru_cache(maxsize=4096)
+def ToN(string):
+    '''Converts string number with optional prefix and unit to a float,
+        e.g. '13u', '10ms', '25.98MHz', '2k' '''
+    if type(string) != str:
+        return float(string)
+    match = VALUE.match(string)
+    if match is None:
+        raise ValueError('could not convert string to float: ' + repr(string))
+    number, prefix, unit = match.groups()
+    if prefix == '':
+        return float(number)
+    return float(number)*PREFIXES[prefix]
+
+
+
+@lru_cache(maxsize=4096)
+def ToStr(num, digits=3):
+    '''Converts time in seconds to string format with suffix,
+        e.g. 0.000013 to '13u', rounded to digits significant digits
+        digits: None keeps all digits, so ToStr(ToN(value), None)
+            gives back value for values written like '12.34u' '''
+    # check for zero, return without suffix
+    if num == 0:
+        return '{:.{}g}'.format(num, digits or 3) + 's'
+
+    # find correct suffix, same rescaling as the measurement lists had
+    sign = '-' if num < 0 else ''
+    num = abs(num)
+    count = 0
+    while num < 1 and count < len(SUFFIXES) - 1:
+        count += 1
+        num = num*1000
+    text = Format(num, digits)
+
+    # Rounding up may reach the next suffix, e.g. 999.9u is 1m
+    if count > 0 and float(text) >= 1000:
+        count -= 1
+        text = Format(float(text)/1000, digits)
+
+    return sign + text + (SUFFIXES[count] or 's')
+
+
+
+def Format(num, digits):
+    '''Number rounded to digits significant digits, None removes only
+        the last bits of floating point error'''
+    if digits is None:
+        # Values from ToN are exact to about 16 digits
+        return '{:.15g}'.format(num)
+    return '{:.{}g}'.format(num, digits)
+
+
+
+def To_array(values):
+    '''Converts a delay list string or sequence of values
+        to a numpy array of floats'''
+    if type(values) == str:
+        values = values.split(' ')
+    return np.fromiter((ToN(value) for value in values), dtype=float,
+        count=len(values))
+
+
+
+if __name__ == "__main__":
+    import time
+
+    def Old_ToStr(num):
+        '''ToStr before this module, rescaling loop'''
+        suffixes = {0: 's', 1: 'm', 2: 'u', 3: 'n', 4: 'p'}
+        if num == 0:
+            return '{:.3g}'.format(num) + suffixes[0]
+        count = 0
+        while num < 1 and count < 4:
+            count += 1
+            num = num*1000
+        return '{:.3g}'.format(num) + suffixes[count]
+
+    for value in ['13u', '13.52m', '3u', '3.0u', '1s', '660m', '100n', '0']:
+        print(value, ToN(value), ToStr(ToN(value)))
+    for value in ['25.98MHz', '77.693MHz', '10ms', '5p', '2k', '1e-3s']:
+        print(value, ToN(value))
+    for num in [0, 1e-31, 1e-9, 0.0009996, -2e-6, 1.5, 0.001]:
+        print(num, ToStr(num))
+
+    # Same strings as the old ToStr, apart from the carry to the next
+    # suffix which gave e.g. '1e+03u'
+    rng = np.random.default_rng(0)
+    delays = np.concatenate([10**rng.uniform(-9, 1, 20000),
+        np.floor(10**rng.uniform(-6, 1, 20000)*10**8/10)/10**7])
+    for num in delays.tolist():
+        old = Old_ToStr(num)
+        assert ToStr(num) == old or 'e+03' in old, (num, ToStr(num), old)
+    print('Same as old ToStr for', len(delays), 'delays')
+
+    # Exact round trip of values as TNMR writes them, up to 6 digits
+    values = list()
+    for i in range(20000):
+        number = str(rng.integers(1, 1000))
+        decimals = str(rng.integers(0, 1000))[:rng.integers(4)].rstrip('0')
+        if decimals:
+            number += '.' + decimals
+        values.append(number + 'smunp'[i % 5])
+    for value in values + ['12.34u', '999.999m', '3.1415n', '1s']:
+        assert ToStr(ToN(value), None) == value, (value,
+            ToStr(ToN(value), None))
+        # Three digits are enough for most delays
+        if len(value.replace('.', '')) <= 4:
+            assert ToStr(ToN(value)) == value, (value, ToStr(ToN(value)))
+    print('Round trip exact for', len(values), 'values')
+
+    # Timing of a repeated delay list
+    d5_list = ' '.join(ToStr(d5) for d5 in np.geomspace(1e-6, 1, 200))
+    start = time.time()
+    for _ in range(100):
+        To_array(d5_list)
+    print('200 delays: {:.3f} ms'.format(10*(time.time() - start)))
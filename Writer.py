@@ -0,0 +1,155 @@
+# Background writing of exported files while the next point is measured
+
+# Imports
+import queue
+import threading
+
+from NMR7 import Legacy_export
+
+# Global variables
+QUEUE_SIZE = 4  # Points waiting to be written before measuring blocks
+
+
+
+class Export_writer():
+    '''Writes exports in a background thread, use with "with" to make sure
+        everything is written and errors are raised before continuing'''
+
+    def __init__(self, export=Legacy_export, size=QUEUE_SIZE):
+        '''Initialization with export function taking (data, params)
+            and maximum number of points waiting in the queue'''
+        self.export = export
+        self.queue = queue.Queue(maxsize=size)
+        # First error raised in the writing thread
+        self.error = None
+
+        self.thread = threading.Thread(target=self.Run, daemon=True)
+        self.thread.start()
+
+
+    def __enter__(self):
+        '''Entering functions when class is started up with with'''
+        return self
+
+
+    def __exit__(self, e_type, e_value, e_traceback):
+        '''Writes the remaining points, raises write errors
+            unless an error is already on its way'''
+        self.Close(raise_error=e_value is None)
+
+
+    def Put(self, data, params):
+        '''Queues data for writing with a snapshot of params,
+            blocks only if the queue is full'''
+        self.Check()
+        self.queue.put((data, dict(params)))
+
+
+    def Run(self):
+        '''Writing loop running in the background thread'''
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None: break  # Closing
+                self.export(*item)
+            except Exception as e:
+                print('Failed writing', item[1].get('file_name'), e)
+                if self.error is None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+
+    def Check(self):
+        '''Raises the error from the writing thread'''
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+    def Flush(self):
+        '''Waits until all queued points are written'''
+        self.queue.join()
+        self.Check()
+
+
+    def Close(self, raise_error=True):
+        '''Writes remaining points and stops the thread'''
+        self.queue.put(None)
+        self.thread.join()
+        if raise_error:
+            self.Check()
+
+
+
+class Serial_writer():
+    '''Same interface as Export_writer, but writes immediately'''
+
+    def __init__(self, export=Legacy_export):
+        '''Initialization with export function taking (data, params)'''
+        self.export = export
+
+
+    def __enter__(self):
+        '''Entering functions when class is started up with with'''
+        return self
+
+
+    def __exit__(self, e_type, e_value, e_traceback):
+        '''Nothing is left to write'''
+        pass
+
+
+    def Put(self, data, params):
+        '''Writes data right away'''
+        self.export(data, params)
+
+
+    def Flush(self):
+        '''Nothing is left to write'''
+        pass
+
+
+
+if __name__ == "__main__":
+    # Compare serial and background writing on simulated TNMR
+    import os
+    import tempfile
+    import time
+
+    import numpy as np
+
+    from TNMR_legacy import Tecmag
+
+    A = Tecmag(simulate=True)
+    A.Test_params()
+    A.params['file_path'] = tempfile.mkdtemp() + os.sep
+    os.mkdir(A.params['file_path'] + 'export\\')
+    A.params['TD'] = '16384'
+    A.params['NS'] = '1'
+    A.params['D9'] = '50m'
+    A.params['D5min'] = '10u'
+    A.params['D5max'] = '10m'
+
+    # Median of a few sweeps, single sweeps vary by about 0.1 s
+    times = {False: [], True: []}
+    for repeat in range(3):
+        for background in [False, True]:
+            A.background = background
+            A.params['file_name'] = 'T1-bench'
+            start = time.time()
+            A.Get_T1(A.params, single=False)
+            times[background].append(time.time() - start)
+    serial, overlapped = (sorted(times[key])[1] for key in [False, True])
+
+    # Time of the exports alone, the most background writing can save
+    data = np.zeros(2*int(A.params['TD']))
+    points = int(A.params['D5N'])
+    start = time.time()
+    for i in range(points):
+        Legacy_export(data, dict(A.params, file_name='T1-export'))
+    exports = time.time() - start
+
+    print('Serial: {:.2f} s, background: {:.2f} s'.format(serial, overlapped))
+    print('Exports take {:.2f} s, background writing saved {:.2f} s'.format(
+        exports, serial - overlapped))